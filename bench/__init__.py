@@ -0,0 +1 @@
+"""Benchmarks for D-Inventory. Run from the repo root, e.g. `python -m bench.pool_latency`."""
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Parallel checkouts against the same few items.
+
+Several processes (gunicorn workers), each with several threads (concurrent
+requests), hammer commit_sale() with random carts drawn from a small, hot set
+of items - once writing inline and once through the group-commit write queue.
+Afterwards the ledger is checked: no item may go negative and initial stock -
+sold qty must equal the final stock for every item. Exits non-zero when it
+doesn't, so the run can gate a change.
+
+    python -m bench.checkout_stress --procs 4 --threads 8 --checkouts 100 --items 20
+    python -m bench.checkout_stress --stock 500      # most checkouts hit the oversell guard
+"""
+import argparse, multiprocessing as mp, random, sqlite3, sys, threading, time
+from bench.common import load_app, emit, percentiles
+
+def worker(args):
+    n, n_items, lines, threads, queued, seed = args
+    import d
+    d.DB_WRITE_QUEUE = queued
+    counts = {"ok": 0, "rejected": 0, "locked": 0}; samples = []; lock = threading.Lock()
+
+    def run(tseed):
+        rnd = random.Random(tseed)
+        for _ in range(n):
+            cart = {str(i): {"part": f"S{i}", "desc": "stress", "price": 1.0, "qty": rnd.randint(1, 5)}
+                    for i in rnd.sample(range(1, n_items + 1), lines)}
+            t0 = time.perf_counter()
+            try:
+                d.commit_sale(d.quote_from_cart(cart, "bench")); key = "ok"
+            except d.OutOfStock:
+                key = "rejected"
+            except sqlite3.OperationalError:
+                key = "locked"
+            with lock: counts[key] += 1; samples.append(time.perf_counter() - t0)
+
+    ts = [threading.Thread(target=run, args=(seed * 1000 + t,)) for t in range(threads)]
+    for t in ts: t.start()
+    for t in ts: t.join()
+    return counts, samples, d.write_queue.batches
+
+def run_mode(d, a, queued):
+    c = d.db()
+    c.execute("DELETE FROM items"); c.execute("DELETE FROM quotes"); c.execute("DELETE FROM quote_items"); c.execute("DELETE FROM movements")
+    c.executemany("INSERT INTO items(id,part_number,description,price,stock,min_stock) VALUES(?,?,?,?,?,0)",
+                  [(i, f"S{i}", "stress", 1.0, a.stock) for i in range(1, a.items + 1)])
+    c.commit(); c.close(); d.close_pool()
+    t0 = time.perf_counter()
+    with mp.get_context("fork").Pool(a.procs) as pool:
+        res = pool.map(worker, [(a.checkouts, a.items, min(a.lines, a.items), a.threads, queued, s) for s in range(a.procs)])
+    wall = time.perf_counter() - t0
+    ok, rejected, locked = (sum(r[0][k] for r in res) for k in ("ok", "rejected", "locked"))
+    batches = sum(r[2] for r in res)
+    c = d.db()
+    bad = c.execute("""SELECT i.id, i.stock, ? - COALESCE((SELECT SUM(qi.qty) FROM quote_items qi WHERE qi.part_number = i.part_number), 0) AS expect,
+                              ? + COALESCE((SELECT SUM(m.qty_change) FROM movements m WHERE m.item_id = i.id), 0) AS ledger
+                       FROM items i""", (a.stock, a.stock)).fetchall()
+    mismatched = [tuple(r) for r in bad if r["stock"] < 0 or r["stock"] != r["expect"] or r["stock"] != r["ledger"]]
+    quotes = c.execute("SELECT COUNT(*) FROM quotes").fetchone()[0]; c.close(); d.close_pool()
+    attempted = a.procs * a.threads * a.checkouts
+    return {"attempted": attempted, "committed": ok, "rejected_out_of_stock": rejected,
+            "lock_errors": locked, "lock_error_rate": round(locked / attempted, 4), "quotes_rows": quotes,
+            "group_commits": batches if queued else None, "oversold_or_mismatched_items": mismatched,
+            "latency": percentiles([x for r in res for x in r[1]]),
+            "wall_s": round(wall, 3), "checkouts_per_s": round(ok / wall, 1)}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--procs", type=int, default=4, help="worker processes")
+    ap.add_argument("--threads", type=int, default=8, help="concurrent checkouts per process")
+    ap.add_argument("--checkouts", type=int, default=100, help="per thread")
+    ap.add_argument("--items", type=int, default=20)
+    ap.add_argument("--lines", type=int, default=5, help="cart lines per checkout")
+    ap.add_argument("--stock", type=int, default=100000, help="initial stock per item (small values exercise the oversell guard)")
+    ap.add_argument("--mode", choices=("direct", "queue", "both"), default="both")
+    a = ap.parse_args()
+    d = load_app(DSHOP_PDF_THREADS=0)
+    out = {"procs": a.procs, "threads": a.threads}
+    for mode in (("direct", "queue") if a.mode == "both" else (a.mode,)):
+        out[mode] = run_mode(d, a, mode == "queue")
+    emit(out)
+    failed = [m for m in ("direct", "queue") if m in out and out[m]["oversold_or_mismatched_items"]]
+    if failed:
+        print("oversold or ledger mismatch (id, stock, expected, ledger) in: " + ", ".join(failed), file=sys.stderr); sys.exit(1)
+
+if __name__ == "__main__":
+    main()
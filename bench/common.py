@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Shared helpers for the benchmark scripts.
+
+Every benchmark runs against a throw-away database in a temp directory so the
+bundled inventory.db is never touched."""
+import os, sys, json, random, tempfile, time, statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_app(workdir=None, db=None, **env):
+    """Import d.py against `db` (default: a fresh database inside `workdir`) and return the module."""
+    workdir = workdir or tempfile.mkdtemp(prefix="dshop-bench-")
+    db = os.path.abspath(db) if db else os.path.join(workdir, "inventory.db")
+    os.chdir(workdir)
+    os.environ["DSHOP_DB"] = db
+    for k, v in env.items(): os.environ[k] = str(v)
+    if ROOT not in sys.path: sys.path.insert(0, ROOT)
+    import d
+    d.app.testing = True
+    return d
+
+WORDS = ["shirt", "jacket", "cotton", "leather", "blue", "black", "red", "belt", "scarf", "boots",
+         "قميص", "جاكيت", "قطن", "جلد", "أزرق", "أسود", "أحمر", "حزام", "وشاح", "حذاء"]
+
+def seed_items(d, n, seed=1):
+    rnd = random.Random(seed)
+    cats = ["Men", "Women", "Kids", "Accessories", ""]
+    rows = [(f"P{i:06d}", " ".join(rnd.sample(WORDS, 3)) + f" size {rnd.choice('SMLX')}", round(rnd.uniform(1, 500), 2), None,
+             rnd.randint(0, 50), rnd.randint(0, 5), rnd.choice(cats)) for i in range(n)]
+    c = d.db()
+    c.executemany("""INSERT INTO items(part_number,description,price,image_path,stock,min_stock,category)
+                     VALUES(?,?,?,?,?,?,?)""", rows)
+    d.link_categories(c.cursor())
+    c.commit(); c.close()
+
+def client(d, username="daouk"):
+    cl = d.app.test_client()
+    with cl.session_transaction() as s: s["username"] = username
+    return cl
+
+def percentiles(samples):
+    s = sorted(samples)
+    pick = lambda q: s[min(len(s) - 1, int(q * len(s)))]
+    return {"n": len(s), "mean_ms": round(statistics.fmean(s) * 1000, 3),
+            "p50_ms": round(pick(0.50) * 1000, 3), "p90_ms": round(pick(0.90) * 1000, 3),
+            "p99_ms": round(pick(0.99) * 1000, 3)}
+
+def time_get(cl, url, n):
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter(); r = cl.get(url); samples.append(time.perf_counter() - t0)
+        assert r.status_code == 200, (url, r.status_code)
+    return percentiles(samples)
+
+def emit(result):
+    print(json.dumps(result, indent=2, ensure_ascii=False))
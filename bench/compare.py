@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""Per-route diff of two bench.traffic reports.
+
+    python -m bench.compare before.json after.json [--fail-over 20]
+
+Prints p50/p99/rps for both runs and the relative change; with --fail-over N
+exits non-zero when any route's p99 got more than N% slower.
+"""
+import argparse, json, sys
+
+def pct(a, b):
+    return round((b - a) / a * 100, 1) if a else None
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("before"); ap.add_argument("after")
+    ap.add_argument("--fail-over", type=float, default=None, help="p99 regression threshold in percent")
+    a = ap.parse_args()
+    with open(a.before, encoding="utf-8") as f: before = json.load(f)
+    with open(a.after, encoding="utf-8") as f: after = json.load(f)
+    rows = {"total": (before.get("total", {}), after.get("total", {}))}
+    for route in sorted(set(before["routes"]) | set(after["routes"])):
+        rows[route] = (before["routes"].get(route, {}), after["routes"].get(route, {}))
+    print(f"# {before['meta'].get('commit')} -> {after['meta'].get('commit')}")
+    print(f"{'route':<16}{'p50 ms':>18}{'p99 ms':>20}{'rps':>18}{'p99 %':>9}")
+    regressed = []
+    for route, (b, n) in rows.items():
+        change = pct(b.get("p99_ms"), n.get("p99_ms")) if b and n else None
+        cell = lambda k: f"{b.get(k, '-')}→{n.get(k, '-')}"
+        print(f"{route:<16}{cell('p50_ms'):>18}{cell('p99_ms'):>20}{cell('rps'):>18}{'' if change is None else change:>9}")
+        if a.fail_over is not None and change is not None and change > a.fail_over and route != "total": regressed.append(route)
+    if regressed:
+        print("p99 regressions: " + ", ".join(regressed)); sys.exit(1)
+
+if __name__ == "__main__":
+    main()
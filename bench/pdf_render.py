@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""Per-quote PDF render time for carts of 10, 100 and 1000 lines.
+
+    python -m bench.pdf_render --repeat 5 [--fonts-dir fonts]
+
+Drop an Arabic TTF (e.g. NotoNaskhArabic-Regular.ttf) into --fonts-dir to
+include shaping; without one, Arabic lines are drawn with Helvetica.
+"""
+import argparse, io, os, random, sys, time
+from bench.common import ROOT, WORDS, percentiles, emit
+
+def make_quote(qp, n, rnd):
+    cart = {str(i): {"part": f"P{i:06d}", "desc": " ".join(rnd.sample(WORDS, 3)), "qty": rnd.randint(1, 5),
+                     "price": round(rnd.uniform(1, 500), 2)} for i in range(n)}
+    return qp.quote_from_cart(cart, "bench", "زبون تجريبي", "0123456789", "ملاحظات")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--fonts-dir", default=os.path.join(ROOT, "fonts"))
+    a = ap.parse_args()
+    if ROOT not in sys.path: sys.path.insert(0, ROOT)
+    import quote_pdf as qp
+    rnd = random.Random(1)
+    out = {"ar_font": qp.register_ar_font(a.fonts_dir), "shaping": qp.SHAPING_OK}
+    for n in (10, 100, 1000):
+        quote = make_quote(qp, n, rnd); samples = []; size = 0
+        for _ in range(a.repeat):
+            buf = io.BytesIO(); t0 = time.perf_counter()
+            qp.render_quote(quote, buf, a.fonts_dir); samples.append(time.perf_counter() - t0); size = buf.tell()
+        out[f"lines_{n}"] = dict(percentiles(samples), pdf_bytes=size)
+    out["ar_shape_cache"] = qp.ar_shape.cache_info()._asdict()
+    emit(out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""p50/p99 latency of `/` and `/history` with and without connection reuse.
+
+    python -m bench.pool_latency --items 5000 --requests 300
+"""
+import argparse
+from bench.common import load_app, seed_items, client, time_get, emit
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=2000)
+    ap.add_argument("--requests", type=int, default=200)
+    a = ap.parse_args()
+    d = load_app(); seed_items(d, a.items)
+    cl = client(d); pool_size = d.DB_POOL_SIZE or 8
+    out = {"items": a.items, "requests": a.requests}
+    for label, size in (("per_call_connect", 0), ("pooled", pool_size)):
+        d.close_pool(); d.DB_POOL_SIZE = size
+        time_get(cl, "/history", 10)   # warm-up
+        out[label] = {url: time_get(cl, url, a.requests) for url in ("/", "/history")}
+    emit(out)
+
+if __name__ == "__main__":
+    main()
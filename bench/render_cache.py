@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Catalog and report render time with the fragment cache off and on.
+
+    python -m bench.render_cache --items 20000 --requests 200
+    python -m bench.render_cache --db /tmp/shop.db --write-every 20
+
+Each route is timed end to end and for its page template alone. With
+--write-every N a one-line sale is recorded every N passes, so the report
+tables keep being invalidated while cards mostly hit; the p99 column is the
+price of those misses.
+"""
+import argparse, random, shutil, tempfile, os, time
+from flask import before_render_template, template_rendered
+from bench.common import load_app, seed_items, client, percentiles, emit
+
+ROUTES = ["/", "/?cat=Men", "/?q=leather", "/reports/low-stock", "/reports/top-selling?by=part", "/reports/top-selling?by=category"]
+
+def sell_one(d, c, rnd, max_id):
+    """Record a one-line sale of a random in-stock item, the way a checkout does."""
+    it = c.execute("SELECT id, part_number, description, price FROM items WHERE id >= ? AND stock > 0 LIMIT 1",
+                   (rnd.randint(1, max_id),)).fetchone()
+    if not it: return
+    d.commit_sale({"created_at": d._now(), "username": "bench", "customer_name": "", "customer_phone": "", "customer_notes": "",
+                   "lines": [{"item_id": it["id"], "part": it["part_number"], "desc": it["description"] or "", "qty": 1,
+                              "price": float(it["price"] or 0)}]})
+
+def run(d, cl, a, rnd):
+    route = {u: [] for u in ROUTES}; render = {u: [] for u in ROUTES}; starts = []; current = []
+
+    def on_start(sender, **kw): starts.append(time.perf_counter())
+    def on_done(sender, **kw): current.append(time.perf_counter() - starts.pop())
+    before_render_template.connect(on_start, d.app); template_rendered.connect(on_done, d.app)
+    c = d.db(); max_id = c.execute("SELECT MAX(id) FROM items").fetchone()[0]
+    try:
+        for i in range(a.requests):
+            if a.write_every and i and i % a.write_every == 0: sell_one(d, c, rnd, max_id)
+            for u in ROUTES:
+                current.clear()
+                t0 = time.perf_counter(); r = cl.get(u); route[u].append(time.perf_counter() - t0)
+                assert r.status_code == 200, (u, r.status_code)
+                render[u].append(sum(current))
+    finally:
+        c.close()
+        before_render_template.disconnect(on_start, d.app); template_rendered.disconnect(on_done, d.app)
+    return {u: {"route": percentiles(route[u]), "template": percentiles(render[u])} for u in ROUTES}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", help="seeded database to copy (default: generate --items)")
+    ap.add_argument("--items", type=int, default=20000)
+    ap.add_argument("--requests", type=int, default=200, help="passes over the route list per mode")
+    ap.add_argument("--write-every", type=int, default=0, help="stock write every N passes; 0 = read only")
+    ap.add_argument("--seed", type=int, default=1)
+    a = ap.parse_args()
+    workdir = tempfile.mkdtemp(prefix="dshop-render-"); path = os.path.join(workdir, "inventory.db")
+    if a.db: shutil.copy(a.db, path)
+    d = load_app(workdir, db=path, DSHOP_PDF_THREADS=0)
+    if not a.db: seed_items(d, a.items, a.seed)
+    cl = client(d); limit = d.fragments.max_bytes
+    out = {"db": a.db or f"generated:{a.items}", "requests": a.requests, "write_every": a.write_every}
+    for mode, size in (("off", 0), ("on", limit)):
+        d.fragments.clear(); d.fragments.max_bytes = size
+        d.fragments.hits.clear(); d.fragments.misses.clear()
+        out[mode] = run(d, cl, a, random.Random(a.seed))
+    fc = d.fragments.stats(); hits, misses = fc["hits"], fc["misses"]
+    out["summary"] = {u: {m: {k: out[m][u]["route"][k] for k in ("p50_ms", "p99_ms")} for m in ("off", "on")} for u in ROUTES}
+    out["hit_rate"] = {k: round(hits.get(k, 0) / (hits.get(k, 0) + misses[k]), 3) for k in misses}
+    out["cache"] = {k: fc[k] for k in ("entries", "bytes", "evictions")}
+    d.close_pool(); shutil.rmtree(workdir, ignore_errors=True)
+    emit(out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Catalog search latency: the old LOWER(..) LIKE '%q%' scan vs the FTS5 index.
+
+    python -m bench.search_latency --items 100000 --requests 50
+"""
+import argparse, time
+from bench.common import load_app, seed_items, client, percentiles, time_get, emit
+
+QUERIES = ["p0123", "P04", "leather", "جلد", "احمر", "black boots"]
+
+def time_sql(c, sql, params, n):
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter(); c.execute(sql, params).fetchall(); samples.append(time.perf_counter() - t0)
+    return percentiles(samples)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=100000)
+    ap.add_argument("--requests", type=int, default=50)
+    a = ap.parse_args()
+    d = load_app(); seed_items(d, a.items)
+    c = d.db(); cl = client(d)
+    out = {"items": a.items, "fts5": d.FTS_OK, "sql": {}, "route": {}}
+    like_sql = ("SELECT * FROM items WHERE (LOWER(part_number) LIKE ? OR LOWER(description) LIKE ?)"
+                " ORDER BY part_number COLLATE NOCASE")
+    fts_sql = ("SELECT items.* FROM items_fts JOIN items ON items.id = items_fts.rowid"
+               " WHERE items_fts MATCH ? ORDER BY items_fts.rank, items.part_number COLLATE NOCASE")
+    for q in QUERIES:
+        lq = q.lower()
+        out["sql"][q] = {"like": time_sql(c, like_sql, (f"%{lq}%", f"%{lq}%"), a.requests)}
+        if d.FTS_OK: out["sql"][q]["fts"] = time_sql(c, fts_sql, (d.fts_query(lq),), a.requests)
+    c.close()
+    for label, fts in (("like", False), ("fts", d.FTS_OK)):
+        d.FTS_OK = fts
+        out["route"][label] = {q: time_get(cl, "/?q=" + q, max(1, a.requests // 5)) for q in QUERIES[:3]}
+    emit(out)
+
+if __name__ == "__main__":
+    main()
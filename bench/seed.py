@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Shop-scale dataset: items with mixed Arabic/Latin text, a year of stock
+movements and quotes, plus the derived rollup and monthly stock checkpoints.
+
+    python -m bench.seed --out /tmp/shop.db                       # 100k items, 1M movements, 200k quotes
+    python -m bench.seed --out /tmp/small.db --items 5000 --movements 60000 --quotes 10000
+
+The same --seed always produces the same database. Rows are written straight
+through sqlite3 after the app's migrations have created the schema; sales lines
+never take an item below zero, so items.stock always equals the ledger.
+"""
+import argparse, os, random, sqlite3, time
+from datetime import datetime, timedelta
+from bench.common import load_app, emit, WORDS
+
+CATEGORIES = ["Men", "Women", "Kids", "Accessories", "Shoes", "رجالي", "نسائي", "أطفال", "إكسسوارات", ""]
+CUSTOMERS = ["Ahmad", "Rami", "Lina", "Maya", "Walk-in", "أحمد", "رامي", "لينا", "مايا", "زبون"]
+BATCH = 20000
+
+def generate(d, path, items=100000, movements=1000000, quotes=200000, days=365, checkpoint_days=30, seed=1):
+    """Fill the (already migrated) database at `path`; returns row counts."""
+    rnd = random.Random(seed)
+    users = list(d.USERS)
+    end = datetime.now().replace(microsecond=0); start = end - timedelta(days=days)
+    ts = lambda t: t.strftime("%Y-%m-%d %H:%M:%S")
+    c = sqlite3.connect(path); c.execute("PRAGMA synchronous=OFF")
+    cur = c.cursor(); cur.execute("BEGIN")
+
+    catalog = [(f"P{i:06d}", " ".join(rnd.sample(WORDS, 3)) + f" size {rnd.choice('SMLX')}", round(rnd.uniform(1, 500), 2),
+                rnd.randint(0, 5), rnd.choice(CATEGORIES)) for i in range(items)]
+    stock = [rnd.randint(20, 200) for _ in range(items)]
+    moves = []; quote_rows = []; line_rows = []
+    mid = qid = 0
+
+    def flush(force=False):
+        if force or len(moves) >= BATCH:
+            cur.executemany("""INSERT INTO movements(id,created_at,item_id,part_number,qty_change,reason,ref_quote_id,note)
+                               VALUES(?,?,?,?,?,?,?,?)""", moves); moves.clear()
+        if force or len(line_rows) >= BATCH:
+            cur.executemany("INSERT INTO quotes(id,created_at,username,customer_name,customer_phone,customer_notes,total) VALUES(?,?,?,?,?,?,?)", quote_rows)
+            cur.executemany("INSERT INTO quote_items(quote_id,part_number,description,qty,price,subtotal,category) VALUES(?,?,?,?,?,?,?)", line_rows)
+            quote_rows.clear(); line_rows.clear()
+
+    for i in range(items):
+        mid += 1; moves.append((mid, ts(start), i + 1, catalog[i][0], stock[i], "new", None, None)); flush()
+
+    # quotes average ~3 sale lines; whatever is left of the movement budget is restocks/adjustments
+    restocks = max(0, movements - items - 3 * quotes)
+    events = quotes + restocks
+    p_quote = quotes / events if events else 0
+    checkpoints = []; next_cp = start + timedelta(days=checkpoint_days) if checkpoint_days else end
+    for frac in sorted(rnd.random() for _ in range(events)):
+        at = start + timedelta(seconds=frac * days * 86400)
+        while next_cp < min(at, end):
+            checkpoints.append((ts(next_cp), mid, list(stock))); next_cp += timedelta(days=checkpoint_days)
+        if rnd.random() < p_quote:
+            lines = []
+            for idx in {int(items * rnd.random() ** 2) for _ in range(rnd.randint(1, 5))}:
+                qty = min(rnd.randint(1, 3), stock[idx])
+                if qty: lines.append((idx, qty))
+            if not lines: continue
+            qid += 1; total = 0.0
+            for idx, qty in lines:
+                part, desc, price = catalog[idx][:3]
+                stock[idx] -= qty; total += price * qty
+                line_rows.append((qid, part, desc, qty, price, price * qty, catalog[idx][4]))
+                mid += 1; moves.append((mid, ts(at), idx + 1, part, -qty, "sale", qid, None))
+            quote_rows.append((qid, ts(at), rnd.choice(users), rnd.choice(CUSTOMERS), f"03{rnd.randint(100000, 999999)}", "", round(total, 2)))
+        else:
+            idx = rnd.randrange(items)
+            delta = rnd.randint(10, 100) if rnd.random() < 0.8 else -min(stock[idx], rnd.randint(1, 3))
+            if not delta: continue
+            stock[idx] += delta
+            mid += 1; moves.append((mid, ts(at), idx + 1, catalog[idx][0], delta, "restock" if delta > 0 else "adjust", None, "bench"))
+        flush()
+    flush(force=True)
+
+    # items go in last, with their final stock, so the low-stock/FTS/version triggers see each row once
+    for lo in range(0, items, BATCH):
+        cur.executemany("INSERT INTO items(id,part_number,description,price,image_path,stock,min_stock,category) VALUES(?,?,?,?,NULL,?,?,?)",
+                        [(i + 1, *catalog[i][:3], stock[i], *catalog[i][3:]) for i in range(lo, min(lo + BATCH, items))])
+    d.link_categories(cur)
+    for taken_at, last_mid, levels in checkpoints:
+        cur.execute("INSERT INTO stock_checkpoint_runs(taken_at, last_movement_id) VALUES(?, ?)", (taken_at, last_mid))
+        run_id = cur.lastrowid
+        cur.executemany("INSERT INTO stock_checkpoints(run_id, item_id, stock) VALUES(?,?,?)",
+                        ((run_id, i + 1, s) for i, s in enumerate(levels)))
+    c.commit()
+    c.execute("PRAGMA wal_checkpoint(TRUNCATE)"); c.close()
+    d.rebuild_sales_rollup(); d.take_stock_checkpoint()
+    return {"items": items, "movements": mid, "quotes": qid, "checkpoint_runs": len(checkpoints) + 1}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", required=True, help="database file to create (must not exist)")
+    ap.add_argument("--items", type=int, default=100000)
+    ap.add_argument("--movements", type=int, default=1000000)
+    ap.add_argument("--quotes", type=int, default=200000)
+    ap.add_argument("--days", type=int, default=365)
+    ap.add_argument("--checkpoint-days", type=int, default=30, help="0 = only a final checkpoint")
+    ap.add_argument("--seed", type=int, default=1)
+    a = ap.parse_args()
+    out = os.path.abspath(a.out)
+    if os.path.exists(out): ap.error(f"{out} already exists")
+    d = load_app(db=out, DSHOP_PDF_THREADS=0)
+    t0 = time.perf_counter()
+    counts = generate(d, out, a.items, a.movements, a.quotes, a.days, a.checkpoint_days, a.seed)
+    d.close_pool()
+    with sqlite3.connect(out) as c: c.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    emit({"db": out, **counts, "seed": a.seed, "size_mb": round(os.path.getsize(out) / 2**20, 1),
+          "seconds": round(time.perf_counter() - t0, 1)})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Replay a weighted shop-traffic mix and report per-route throughput/latency.
+
+    python -m bench.seed --out /tmp/shop.db
+    python -m bench.traffic --db /tmp/shop.db --target client --requests 3000 --out client.json
+    python -m bench.traffic --db /tmp/shop.db --target gunicorn --workers 4 --users 8 --duration 30 --out gunicorn.json
+    python -m bench.compare before.json after.json
+
+Each run works on a copy of --db (checkouts write), so runs are repeatable.
+Without --db a small dataset is generated with bench.seed. `client` drives the
+Flask test client in-process (one virtual user at a time); `gunicorn` starts a
+local server with the repo's gunicorn.conf.py and drives it over HTTP from
+--users threads, each with its own login session; --threads sets gunicorn's
+threads per worker and `writes` reports write-queue ops against group commits.
+"""
+import argparse, json, os, random, re, shutil, socket, sqlite3, subprocess, sys, tempfile, threading, time
+import http.cookiejar, urllib.error, urllib.parse, urllib.request
+from datetime import datetime, timedelta
+from bench.common import ROOT, load_app, percentiles, emit, WORDS
+
+# (label, weight); every label is reported as its own route
+MIX = [("browse", 25), ("browse_category", 8), ("search", 18), ("api_items", 8), ("cart_add", 15), ("checkout", 5),
+       ("history", 5), ("movements", 5), ("top_selling", 4), ("low_stock", 3), ("valuation", 2), ("next_page", 2)]
+
+NEXT_CURSOR = re.compile(rb"[?&;]after=([A-Za-z0-9_-]+)")
+
+class Shop:
+    """What the driver needs to build plausible URLs, read once from the database."""
+    def __init__(self, path):
+        c = sqlite3.connect(path)
+        self.max_id = c.execute("SELECT COALESCE(MAX(id), 0) FROM items").fetchone()[0]
+        self.categories = [r[0] for r in c.execute("SELECT DISTINCT category FROM items WHERE TRIM(COALESCE(category,'')) != ''")]
+        c.close()
+        self.today = datetime.now()
+
+    def request(self, label, rnd, state):
+        """-> (method, url, form data or None)."""
+        if label == "browse": return "GET", "/", None
+        if label == "browse_category": return "GET", "/?" + urllib.parse.urlencode({"cat": rnd.choice(self.categories or ["All"])}), None
+        if label == "search": return "GET", "/?" + urllib.parse.urlencode({"q": rnd.choice(WORDS + ["p01", "P00"])}), None
+        if label == "next_page": return "GET", "/?" + urllib.parse.urlencode({"after": state.get("after", "")}), None
+        if label == "api_items": return "GET", "/api/items?fields=id,part_number,price,stock&n=96", None
+        if label == "cart_add":
+            state["cart"] = state.get("cart", 0) + 1
+            return "POST", f"/cart/add/{rnd.randint(1, max(1, self.max_id))}", {"qty": "1"}
+        if label == "checkout":
+            state["cart"] = 0
+            return "POST", "/quote/export", {"cust_name": "Bench", "cust_phone": "0300000000", "cust_notes": ""}
+        if label == "history": return "GET", "/history", None
+        if label == "movements":
+            start = (self.today - timedelta(days=rnd.randint(1, 60))).strftime("%Y-%m-%d")
+            return "GET", f"/movements?start={start}", None
+        if label == "top_selling":
+            start = (self.today - timedelta(days=rnd.choice((7, 30, 90, 365)))).strftime("%Y-%m-%d")
+            return "GET", f"/reports/top-selling?start={start}&by={rnd.choice(('part', 'category', 'user'))}", None
+        if label == "low_stock": return "GET", "/reports/low-stock", None
+        if label == "valuation":
+            day = (self.today - timedelta(days=rnd.randint(0, 300))).strftime("%Y-%m-%d")
+            return "GET", f"/reports/stock-valuation?date={day}", None
+        raise ValueError(label)
+
+    def observe(self, label, body, state):
+        """Remember the listing's next-page cursor so `next_page` walks deeper pages."""
+        if label in ("browse", "next_page"):
+            m = NEXT_CURSOR.search(body)
+            state["after"] = m.group(1) if m else ""
+
+def pick(rnd, state):
+    label = rnd.choices([m[0] for m in MIX], [m[1] for m in MIX])[0]
+    if label == "checkout" and not state.get("cart"): label = "cart_add"
+    return label
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}; self.errors = {}; self.lock = threading.Lock()
+    def add(self, label, seconds, ok):
+        with self.lock:
+            self.samples.setdefault(label, []).append(seconds)
+            if not ok: self.errors[label] = self.errors.get(label, 0) + 1
+    def report(self, wall):
+        routes = {}
+        for label, s in sorted(self.samples.items()):
+            routes[label] = {**percentiles(s), "errors": self.errors.get(label, 0), "rps": round(len(s) / wall, 2)}
+        total = [x for s in self.samples.values() for x in s]
+        return routes, {**percentiles(total), "errors": sum(self.errors.values()), "rps": round(len(total) / wall, 2)} if total else {}
+
+def run_client(d, shop, a, rec):
+    """One virtual user at a time through the Flask test client."""
+    rnd = random.Random(a.seed); admin = next(u for u, v in d.USERS.items() if v["role"] == "admin")
+    users = []
+    for _ in range(max(1, a.users)):
+        cl = d.app.test_client()
+        with cl.session_transaction() as s: s["username"] = admin
+        users.append((cl, {}))
+    deadline = time.perf_counter() + a.duration if a.duration else None
+    n = 0
+    while (n < a.requests) if not deadline else (time.perf_counter() < deadline):
+        cl, state = users[n % len(users)]; n += 1
+        label = pick(rnd, state); method, url, data = shop.request(label, rnd, state)
+        t0 = time.perf_counter()
+        r = cl.get(url) if method == "GET" else cl.post(url, data=data)
+        rec.add(label, time.perf_counter() - t0, r.status_code < 400)
+        shop.observe(label, r.data, state)
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kw): return None
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0)); return s.getsockname()[1]
+
+def run_gunicorn(d, shop, a, rec, workdir):
+    port = _free_port(); base = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py"), "-w", str(a.workers),
+                             "--threads", str(a.threads), "-b", f"127.0.0.1:{port}", "--log-level", "warning", "d:app"], cwd=workdir, env=env)
+    try:
+        for _ in range(300):
+            try: urllib.request.urlopen(base + "/login", timeout=1); break
+            except Exception: time.sleep(0.1)
+        else: raise RuntimeError("gunicorn did not come up")
+        admin, creds = next((u, v) for u, v in d.USERS.items() if v["role"] == "admin")
+        deadline = time.perf_counter() + (a.duration or 30)
+        per_user = a.requests // max(1, a.users) if not a.duration else None
+
+        def user(i):
+            rnd = random.Random(a.seed * 1000 + i); state = {}
+            opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+            login = urllib.parse.urlencode({"username": admin, "password": creds["password"]}).encode()
+            try: opener.open(base + "/login", login, timeout=30)
+            except urllib.error.HTTPError: pass   # 302 to home
+            n = 0
+            while (n < per_user) if per_user is not None else (time.perf_counter() < deadline):
+                n += 1; label = pick(rnd, state); method, url, data = shop.request(label, rnd, state)
+                body = urllib.parse.urlencode(data).encode() if method == "POST" else None
+                t0 = time.perf_counter()
+                try:
+                    with opener.open(base + url, body, timeout=60) as r: page = r.read(); ok = True
+                except urllib.error.HTTPError as e:
+                    page = e.read(); ok = e.code < 400
+                except Exception:
+                    page = b""; ok = False
+                rec.add(label, time.perf_counter() - t0, ok)
+                shop.observe(label, page, state)
+
+        threads = [threading.Thread(target=user, args=(i,)) for i in range(max(1, a.users))]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        return scrape_writes(base, admin, creds["password"])
+    finally:
+        proc.terminate(); proc.wait(timeout=30)
+
+def scrape_writes(base, user, password):
+    """Write-queue counters from /metrics of whichever worker answers (exact with -w 1)."""
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+    try: opener.open(base + "/login", urllib.parse.urlencode({"username": user, "password": password}).encode(), timeout=30)
+    except urllib.error.HTTPError: pass
+    with opener.open(base + "/metrics", timeout=30) as r: text = r.read().decode()
+    names = {"dshop_write_ops_total": "ops", "dshop_write_batches_total": "batches"}
+    return {names[k]: int(float(v)) for k, v in (ln.split() for ln in text.splitlines() if ln.split()[:1] and ln.split()[0] in names)}
+
+def git_rev():
+    try: return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception: return None
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", help="seeded database to copy (default: generate a small one)")
+    ap.add_argument("--target", choices=("client", "gunicorn"), default="client")
+    ap.add_argument("--requests", type=int, default=2000, help="total requests (ignored with --duration)")
+    ap.add_argument("--duration", type=float, default=0, help="seconds to run instead of a request count")
+    ap.add_argument("--users", type=int, default=4, help="concurrent sessions (gunicorn: threads)")
+    ap.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    ap.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker (1 = one request at a time)")
+    ap.add_argument("--items", type=int, default=20000, help="dataset size when generating")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="also write the JSON report here")
+    a = ap.parse_args()
+    out = os.path.abspath(a.out) if a.out else None
+    workdir = tempfile.mkdtemp(prefix="dshop-traffic-"); path = os.path.join(workdir, "inventory.db")
+    if a.db: shutil.copy(a.db, path)
+    d = load_app(workdir, db=path)
+    if not a.db:
+        from bench.seed import generate
+        generate(d, path, a.items, a.items * 10, a.items * 2, seed=a.seed)
+    shop = Shop(path); rec = Recorder()
+    t0 = time.perf_counter(); writes = None
+    if a.target == "client": run_client(d, shop, a, rec)
+    else: d.close_pool(); writes = run_gunicorn(d, shop, a, rec, workdir)
+    wall = time.perf_counter() - t0
+    routes, total = rec.report(wall)
+    result = {"meta": {"commit": git_rev(), "target": a.target, "started": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                       "db": a.db or f"generated:{a.items}", "users": a.users, "workers": a.workers if a.target == "gunicorn" else None,
+                       "threads": a.threads if a.target == "gunicorn" else None,
+                       "seed": a.seed, "wall_s": round(wall, 3)},
+              "total": total, "routes": routes, "writes": writes}
+    if out:
+        with open(out, "w", encoding="utf-8") as f: json.dump(result, f, indent=2, ensure_ascii=False)
+    emit(result)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,67 @@
 # -*- coding: utf-8 -*-
-import os, sqlite3, uuid
+import os, io, re, csv, sqlite3, threading, time, uuid, json, base64, hashlib, hmac, bisect, queue, mimetypes
+from concurrent.futures import Future
 from decimal import Decimal, InvalidOperation
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional, Tuple
-from flask import Flask, request, redirect, url_for, render_template, session, flash
-from werkzeug.utils import secure_filename
+from collections import OrderedDict
+from functools import lru_cache
+from flask import Flask, Response, jsonify, request, redirect, url_for, render_template, session, flash, g, has_app_context, send_file
+from flask import before_render_template, template_rendered, get_template_attribute
+from werkzeug.utils import secure_filename, safe_join
 from jinja2 import FileSystemLoader
+from markupsafe import Markup
+import click
 
-# -------- ReportLab + Arabic shaping --------
-try:
-    from reportlab.lib.pagesizes import A4
-    from reportlab.pdfgen import canvas as rlcanvas
-    from reportlab.lib.units import mm
-    from reportlab.lib import colors
-    from reportlab.pdfbase import pdfmetrics
-    from reportlab.pdfbase.ttfonts import TTFont
-    REPORTLAB_OK = True
-except Exception:
-    REPORTLAB_OK = False
+# -------- Quotation PDFs (ReportLab + Arabic shaping) --------
+from quote_pdf import REPORTLAB_OK, quote_from_cart, quote_from_rows, quote_total, render_quote
 
-def ar_shape(text: str) -> str:
-    try:
-        if not text: return ""
-        import arabic_reshaper
-        from bidi.algorithm import get_display
-        return get_display(arabic_reshaper.reshape(str(text)))
-    except Exception:
-        return text or ""
+# Search folding: drop tatweel/harakat and unify letter variants so that
+# "أحمر", "احمر" and "أَحْمَر" index and match the same way.
+AR_FOLD = [("\u0640", "")] + [(chr(cp), "") for cp in (*range(0x064B, 0x0653), 0x0670)] + [
+    ("\u0622", "\u0627"), ("\u0623", "\u0627"), ("\u0625", "\u0627"), ("\u0671", "\u0627"),
+    ("\u0649", "\u064A"), ("\u0626", "\u064A"), ("\u0624", "\u0648"), ("\u0629", "\u0647"),
+]
+
+def ar_fold(s: Optional[str]) -> str:
+    s = s or ""
+    for a, b in AR_FOLD: s = s.replace(a, b)
+    return s
 
-def has_ar(s: Optional[str]) -> bool:
-    if not s: return False
-    return any(0x0600 <= ord(ch) <= 0x06FF for ch in s)
+def ar_fold_sql(expr: str) -> str:
+    """Same folding as ar_fold(), as nested replace() calls usable inside triggers."""
+    expr = f"COALESCE({expr},'')"
+    for a, b in AR_FOLD: expr = f"replace({expr},'{a}','{b}')"
+    return expr
+
+# -------- Pillow (image variants) --------
+try:
+    from PIL import Image, ImageOps
+    PIL_OK = True
+except Exception:
+    PIL_OK = False
 
 # --------------- Config ----------------
 APP_TITLE = "D-Inventory (Web)"
-DB_FILE = "inventory.db"
+DB_FILE = os.environ.get("DSHOP_DB", "inventory.db")
+DB_POOL_SIZE = int(os.environ.get("DSHOP_DB_POOL", "8"))   # idle connections kept per worker; 0 disables reuse
+DB_AUTO_MIGRATE = os.environ.get("DSHOP_AUTO_MIGRATE", "1") == "1"   # migrate on import (dev); off under gunicorn
+DB_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "mmap_size=268435456",   # 256 MB
+    "cache_size=-16000",     # ~16 MB page cache
+    "busy_timeout=5000",
+    "temp_store=MEMORY",
+)
 STATIC_DIR = "static"
 IMG_DIR = os.path.join(STATIC_DIR, "images").replace("\\", "/")
+QUOTE_DIR = os.path.join(STATIC_DIR, "quotes").replace("\\", "/")
+STATIC_SENDFILE = os.environ.get("DSHOP_SENDFILE", "")   # "", "x-sendfile" or "x-accel:/internal-prefix/"
 FONTS_DIR = "fonts"
 ALLOWED_EXT = {"png","jpg","jpeg","gif","bmp"}
+IMAGE_SIZES = {"thumb": 320, "card": 640, "full": 1600}   # longest edge, px
+IMAGE_FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
 
 USERS = {
     "daouk": {"password": "killerkk88", "role": "admin"},
@@ -47,15 +70,100 @@ USERS = {
 
 os.makedirs(STATIC_DIR, exist_ok=True)
 os.makedirs(IMG_DIR, exist_ok=True)
+os.makedirs(QUOTE_DIR, exist_ok=True)
 os.makedirs(FONTS_DIR, exist_ok=True)
 
 app = Flask(__name__, static_folder=STATIC_DIR, template_folder="templates")
 app.jinja_loader = FileSystemLoader(os.path.join(os.path.dirname(__file__), "templates"))
 app.secret_key = "replace-with-strong-secret"
+# --------------- Metrics ----------------
+# In-process histograms served at /metrics in Prometheus text format. Numbers
+# are per process: with several gunicorn workers each scrape sees one worker.
+METRICS_ON = os.environ.get("DSHOP_METRICS", "1") == "1"
+METRICS_TOKEN = os.environ.get("DSHOP_METRICS_TOKEN", "")          # lets a scraper in without an admin session
+SLOW_QUERY_MS = float(os.environ.get("DSHOP_SLOW_QUERY_MS", "0"))   # log statements slower than this; 0 = off
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+def _label(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS, label: Optional[str] = None):
+        self.name, self.help, self.buckets, self.label = name, help, buckets, label
+        self._series = {}; self._lock = threading.Lock()
+
+    def observe(self, value: float, key: str = ""):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None: s = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1; s[1] += value; s[2] += 1
+
+    def expose(self) -> list:
+        with self._lock: series = {k: (list(b), t, n) for k, (b, t, n) in self._series.items()}
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, n) in sorted(series.items()):
+            lab = f'{self.label}="{_label(key)}",' if self.label else ""
+            acc = 0
+            for le, cnt in zip(self.buckets, counts):
+                acc += cnt; out.append(f'{self.name}_bucket{{{lab}le="{le}"}} {acc}')
+            out.append(f'{self.name}_bucket{{{lab}le="+Inf"}} {n}')
+            lab = "{" + lab.rstrip(",") + "}" if lab else ""
+            out += [f"{self.name}_sum{lab} {round(total, 6)}", f"{self.name}_count{lab} {n}"]
+        return out
+
+REQUEST_SECONDS = Histogram("dshop_request_seconds", "Request latency by endpoint.", label="endpoint")
+REQUEST_SQL_STATEMENTS = Histogram("dshop_request_sql_statements", "SQL statements executed per request.", COUNT_BUCKETS, label="endpoint")
+REQUEST_SQL_SECONDS = Histogram("dshop_request_sql_seconds", "Time spent executing SQL per request.", label="endpoint")
+TEMPLATE_SECONDS = Histogram("dshop_template_render_seconds", "Jinja render time by template.", label="template")
+PDF_RENDER_SECONDS = Histogram("dshop_pdf_render_seconds", "Quotation PDF render time.")
+METRICS = [REQUEST_SECONDS, REQUEST_SQL_STATEMENTS, REQUEST_SQL_SECONDS, TEMPLATE_SECONDS, PDF_RENDER_SECONDS]
+
+_sql_thread = threading.local()   # statement count outside a request (the db-writer thread)
+
+def record_sql(sql: str, seconds: float):
+    if has_app_context():
+        g._sql_n = g.get("_sql_n", 0) + 1; g._sql_t = g.get("_sql_t", 0.0) + seconds
+    else:
+        _sql_thread.n = getattr(_sql_thread, "n", 0) + 1
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        app.logger.warning("slow query %.1f ms: %s", seconds * 1000, " ".join(sql.split())[:500])
+
+def record_write(seconds: float, statements: int):
+    """Charge a queued write to the request that waited for it: the wait (queueing,
+    the group's other operations and the commit) plus its own statements."""
+    if has_app_context():
+        g._sql_n = g.get("_sql_n", 0) + statements; g._sql_t = g.get("_sql_t", 0.0) + seconds
+
+def _metrics_start():
+    g._t0 = time.perf_counter(); g._sql_n = 0; g._sql_t = 0.0
+
+def _metrics_finish(exc):
+    t0 = g.pop("_t0", None)
+    if t0 is None: return
+    endpoint = request.endpoint or "unmatched"
+    REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint)
+    REQUEST_SQL_STATEMENTS.observe(g.get("_sql_n", 0), endpoint)
+    REQUEST_SQL_SECONDS.observe(g.get("_sql_t", 0.0), endpoint)
+
+def _template_start(sender, template, context, **extra):
+    g.setdefault("_tpl_t0", []).append(time.perf_counter())
+
+def _template_done(sender, template, context, **extra):
+    stack = g.get("_tpl_t0")
+    if stack: TEMPLATE_SECONDS.observe(time.perf_counter() - stack.pop(), template.name or "-")
+
+if METRICS_ON:
+    app.before_request(_metrics_start)   # registered ahead of the login gate so redirects are timed too
+    app.teardown_request(_metrics_finish)
+    before_render_template.connect(_template_start, app)
+    template_rendered.connect(_template_done, app)
+
 # --------------- Auth gate (login required) --------------
 from flask import abort
 
-PUBLIC_ENDPOINTS = {"login", "static"}
+PUBLIC_ENDPOINTS = {"login", "static", "metrics"}   # /metrics checks admin/token itself
 
 @app.before_request
 def _require_login():
@@ -69,22 +177,179 @@ def _require_login():
 
 
 # --------------- DB helpers ----------------
-def db():
-    c = sqlite3.connect(DB_FILE)
+SQL_TIMING = METRICS_ON or SLOW_QUERY_MS > 0
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that reports each statement's execute time to record_sql()."""
+    def execute(self, sql, params=()):
+        t0 = time.perf_counter()
+        try: return super().execute(sql, params)
+        finally: record_sql(sql, time.perf_counter() - t0)
+
+    def executemany(self, sql, seq):
+        t0 = time.perf_counter()
+        try: return super().executemany(sql, seq)
+        finally: record_sql(sql, time.perf_counter() - t0)
+
+class PooledConnection(sqlite3.Connection):
+    """Connection whose close() hands it back to the pool instead of closing it.
+    Inside a request the same connection is shared by every db() call and only
+    released on app-context teardown."""
+    request_bound = False
+    def close(self):
+        if self.request_bound: return
+        _release(self)
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or (TimedCursor if SQL_TIMING else sqlite3.Cursor))
+
+    # the C-level shortcuts bypass cursor(); route them through it
+    def execute(self, sql, params=()): return self.cursor().execute(sql, params)
+    def executemany(self, sql, seq): return self.cursor().executemany(sql, seq)
+
+_pool = []; _pool_lock = threading.Lock(); _pool_pid = os.getpid()
+
+def _connect():
+    c = sqlite3.connect(DB_FILE, timeout=5, factory=PooledConnection, check_same_thread=False)
     c.row_factory = sqlite3.Row
+    for p in DB_PRAGMAS: c.execute(f"PRAGMA {p}")
     return c
 
-def ensure_column(table: str, name: str, type_sql: str):
+def _acquire():
+    global _pool_pid
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            # forked (gunicorn --preload): never share the parent's handles
+            _pool.clear(); _pool_pid = os.getpid()
+        if _pool: return _pool.pop()
+    return _connect()
+
+def _release(c):
+    if c.in_transaction: c.rollback()
+    with _pool_lock:
+        if _pool_pid == os.getpid() and len(_pool) < DB_POOL_SIZE:
+            _pool.append(c); return
+    sqlite3.Connection.close(c)
+
+def close_pool():
+    with _pool_lock:
+        conns = list(_pool); _pool.clear()
+    for c in conns: sqlite3.Connection.close(c)
+
+def db():
+    if DB_POOL_SIZE > 0 and has_app_context():
+        c = g.get("_db")
+        if c is None:
+            c = g._db = _acquire(); c.request_bound = True
+        return c
+    return _acquire()
+
+@app.teardown_appcontext
+def _release_db(exc):
+    c = g.pop("_db", None)
+    if c is not None:
+        c.request_bound = False; _release(c)
+
+# ---- Write coordination ----
+# Request writes go through db_write(): one writer thread per process drains
+# whatever is queued into a single BEGIN IMMEDIATE transaction (a savepoint per
+# operation, so a failing one only undoes itself) and commits once. Readers keep
+# their own WAL connections. Batching needs concurrent requests in one process,
+# hence gthread workers (gunicorn.conf.py). Across workers SQLite's lock still
+# decides, but each process contends with one connection and a busy lock is
+# retried here instead of surfacing as an error. DSHOP_WRITE_QUEUE=0 writes inline.
+DB_WRITE_QUEUE = os.environ.get("DSHOP_WRITE_QUEUE", "1") == "1"
+WRITE_BATCH = 64           # max operations per group commit
+WRITE_BUSY_RETRIES = 5     # BEGIN IMMEDIATE attempts, each waiting out busy_timeout
+
+def _begin_immediate(cur):
+    for attempt in range(WRITE_BUSY_RETRIES):
+        try:
+            cur.execute("BEGIN IMMEDIATE"); return
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) or attempt == WRITE_BUSY_RETRIES - 1: raise
+            time.sleep(0.05 * (attempt + 1))
+
+class WriteQueue:
+    def __init__(self):
+        self._q = queue.SimpleQueue(); self._lock = threading.Lock()
+        self._thread = None; self._pid = None
+        self.batches = self.ops = 0
+
+    def submit(self, fn, *args):
+        """Run fn(cur, *args) in the next group commit; returns its result or raises its exception."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._q = queue.SimpleQueue(); self._pid = os.getpid(); self._thread = None   # forked
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, args=(self._q,), name="db-writer", daemon=True)
+                self._thread.start()
+            fut = Future(); self._q.put((fn, args, fut))
+        t0 = time.perf_counter()
+        try: return fut.result()
+        finally: record_write(time.perf_counter() - t0, getattr(fut, "sql_n", 0))
+
+    def _run(self, q):
+        c = None
+        while True:
+            batch = [q.get()]
+            while len(batch) < WRITE_BATCH:
+                try: batch.append(q.get_nowait())
+                except queue.Empty: break
+            try:
+                c = c or _connect()
+                self._apply(c, batch)
+            except BaseException as e:
+                for _, _, fut in batch:
+                    if not fut.done(): fut.set_exception(e)
+                if c is not None: sqlite3.Connection.close(c); c = None
+
+    def _apply(self, c, batch):
+        cur = c.cursor(); _begin_immediate(cur)
+        results = []
+        try:
+            for fn, args, fut in batch:
+                cur.execute("SAVEPOINT write_op"); n0 = getattr(_sql_thread, "n", 0)
+                try:
+                    results.append((fut, fn(cur, *args), None)); cur.execute("RELEASE write_op")
+                except Exception as e:
+                    cur.execute("ROLLBACK TO write_op"); cur.execute("RELEASE write_op"); results.append((fut, None, e))
+                fut.sql_n = getattr(_sql_thread, "n", 0) - n0
+            c.commit()
+        except BaseException:
+            if c.in_transaction: c.rollback()
+            raise
+        self.batches += 1; self.ops += len(batch)
+        for fut, res, err in results:
+            if err is None: fut.set_result(res)
+            else: fut.set_exception(err)
+
+write_queue = WriteQueue()
+
+def db_write(fn, *args):
+    """Apply fn(cur, *args) as one atomic write. fn must not touch request state or commit."""
+    if DB_WRITE_QUEUE: return write_queue.submit(fn, *args)
     c = db(); cur = c.cursor()
-    cur.execute(f"PRAGMA table_info({table})")
-    cols = [r[1] for r in cur.fetchall()]
+    try:
+        _begin_immediate(cur); res = fn(cur, *args); c.commit(); return res
+    except BaseException:
+        if c.in_transaction: c.rollback()
+        raise
+    finally:
+        c.close()
+
+# --------------- Schema migrations ----------------
+# PRAGMA user_version records the last applied step. Each step runs in its own
+# BEGIN IMMEDIATE transaction and the version is re-read after taking the write
+# lock, so concurrent migrators serialize and every step runs exactly once.
+# Deployments run `flask --app d db-migrate` (gunicorn.conf.py does it in the
+# master); a worker import only compares versions.
+def ensure_column(cur, table: str, name: str, type_sql: str):
+    cols = [r[1] for r in cur.execute(f"PRAGMA table_info({table})").fetchall()]
     if name not in cols:
         cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {type_sql}")
-        c.commit()
-    c.close()
 
-def init_db():
-    c = db(); cur = c.cursor()
+def _m001_base(cur):
     cur.execute("""CREATE TABLE IF NOT EXISTS items(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         part_number TEXT UNIQUE NOT NULL,
@@ -123,28 +388,438 @@ def init_db():
         ref_quote_id INTEGER,
         note TEXT
     )""")
-    c.commit(); c.close()
-    ensure_column("items", "min_stock", "INTEGER DEFAULT 0")
-    ensure_column("items", "category", "TEXT")
-    ensure_column("quotes", "customer_notes", "TEXT")
-init_db()
+    ensure_column(cur, "items", "min_stock", "INTEGER DEFAULT 0")
+    ensure_column(cur, "items", "category", "TEXT")
+    ensure_column(cur, "quotes", "customer_notes", "TEXT")
 
-def normalize_image_paths():
-    c = db(); cur = c.cursor()
-    cur.execute("SELECT id, image_path FROM items WHERE image_path IS NOT NULL AND image_path != ''")
-    rows = cur.fetchall()
-    changed = 0
+def _m002_image_paths(cur):
+    """Point legacy image paths (Windows separators, bare names) at static/images/."""
+    rows = cur.execute("SELECT id, image_path FROM items WHERE image_path IS NOT NULL AND image_path != ''").fetchall()
     for r in rows:
         p = (r["image_path"] or "").replace("\\","/")
-        if not p: continue
-        if p.startswith("static/"): continue
+        if not p or p.startswith("static/"): continue
         fname = os.path.basename(p)
         if not fname: continue
-        fixed = f"static/images/{fname}"
-        cur.execute("UPDATE items SET image_path=? WHERE id=?", (fixed, r["id"])); changed += 1
-    if changed: c.commit()
+        cur.execute("UPDATE items SET image_path=? WHERE id=?", (f"static/images/{fname}", r["id"]))
+
+# Keys the paginated listings sort on
+def _m003_indexes(cur):
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_items_part_nocase ON items(part_number COLLATE NOCASE, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_quotes_created ON quotes(created_at, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_movements_created ON movements(created_at, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_quote_items_quote ON quote_items(quote_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_movements_item ON movements(item_id, created_at)")
+
+# An item is "low" when it is at/below its alert level or out of stock. The same
+# expression backs the partial index, the counter triggers and the report query,
+# so SQLite can prove the report's WHERE matches the index.
+def low_stock_cond(t: str = "") -> str:
+    return (f"(({t}stock IS NOT NULL AND {t}min_stock IS NOT NULL AND {t}stock <= {t}min_stock)"
+            f" OR ({t}stock IS NULL OR {t}stock = 0))")
+
+def _m004_low_stock(cur):
+    cur.execute("CREATE TABLE IF NOT EXISTS counters(name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_items_low ON items(stock, part_number COLLATE NOCASE) WHERE {low_stock_cond()}")
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_items_low_ins AFTER INSERT ON items WHEN {low_stock_cond('NEW.')}
+                    BEGIN UPDATE counters SET value = value + 1 WHERE name = 'low_stock'; END""")
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_items_low_del AFTER DELETE ON items WHEN {low_stock_cond('OLD.')}
+                    BEGIN UPDATE counters SET value = value - 1 WHERE name = 'low_stock'; END""")
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_items_low_upd AFTER UPDATE OF stock, min_stock ON items
+                    WHEN {low_stock_cond('NEW.')} != {low_stock_cond('OLD.')}
+                    BEGIN UPDATE counters SET value = value + {low_stock_cond('NEW.')} - {low_stock_cond('OLD.')}
+                          WHERE name = 'low_stock'; END""")
+    # seed once; from here on the triggers keep it exact
+    if not cur.execute("SELECT 1 FROM counters WHERE name='low_stock'").fetchone():
+        cur.execute(f"INSERT INTO counters(name, value) SELECT 'low_stock', COUNT(*) FROM items WHERE {low_stock_cond()}")
+
+# Contentless FTS5 index over folded part_number/description/category, keyed by
+# items.id. Falls back to LIKE scans when the SQLite build has no FTS5.
+FTS_OK = False
+FTS_TOKENIZE = "unicode61 remove_diacritics 2 tokenchars '-_./'"
+
+def _fts_row(op: str, t: str) -> str:
+    cols = ", ".join(ar_fold_sql(f"{t}{col}") for col in ("part_number", "description", "category"))
+    if op == "delete":
+        return f"INSERT INTO items_fts(items_fts, rowid, part_number, description, category) VALUES('delete', {t}id, {cols});"
+    return f"INSERT INTO items_fts(rowid, part_number, description, category) VALUES({t}id, {cols});"
+
+def _m005_search(cur):
+    exists = cur.execute("SELECT 1 FROM sqlite_master WHERE name='items_fts'").fetchone()
+    try:
+        cur.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+                        part_number, description, category, content='', tokenize="{FTS_TOKENIZE}")""")
+    except sqlite3.OperationalError:
+        return   # no FTS5 in this SQLite build
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_items_fts_ins AFTER INSERT ON items BEGIN {_fts_row('insert', 'NEW.')} END")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_items_fts_del AFTER DELETE ON items BEGIN {_fts_row('delete', 'OLD.')} END")
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_items_fts_upd AFTER UPDATE OF part_number, description, category ON items
+                    BEGIN {_fts_row('delete', 'OLD.')} {_fts_row('insert', 'NEW.')} END""")
+    if not exists:
+        cols = ", ".join(ar_fold_sql(col) for col in ("part_number", "description", "category"))
+        cur.execute(f"INSERT INTO items_fts(rowid, part_number, description, category) SELECT id, {cols} FROM items")
+
+def fts_query(q: str) -> str:
+    """Turn user input into an FTS5 MATCH string: every term must match as a prefix."""
+    terms = [t.replace('"', '""') for t in ar_fold(q).split()]
+    return " ".join(f'"{t}"*' for t in terms if t)
+
+def _m006_pdf_jobs(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS pdf_jobs(
+        quote_id INTEGER PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        started_at TEXT,
+        finished_at TEXT,
+        error TEXT
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pdf_jobs_status ON pdf_jobs(status, quote_id)")
+
+# Sales rollups, upserted inside commit_sale() so reports never read the sales
+# history itself:
+#   sales_daily             (day, part)       top sellers for a date range
+#   sales_parts             (part)            all-time top sellers; bounded by the catalog
+#   sales_daily_users       (day, user)       by-user breakdown
+#   sales_daily_categories  (day, category)   by-category breakdown, '' = uncategorized
+def _fill_sales_rollup(cur) -> int:
+    for t in ("sales_daily", "sales_parts", "sales_daily_users", "sales_daily_categories"): cur.execute(f"DELETE FROM {t}")
+    cur.execute("""INSERT INTO sales_daily(day, part_number, description, qty, revenue, quotes)
+                   SELECT substr(q.created_at, 1, 10), qi.part_number, MAX(qi.description),
+                          SUM(qi.qty), SUM(qi.subtotal), COUNT(DISTINCT q.id)
+                   FROM quote_items qi JOIN quotes q ON q.id = qi.quote_id
+                   GROUP BY 1, 2""")
+    cur.execute("""INSERT INTO sales_parts(part_number, description, qty, revenue, quotes)
+                   SELECT part_number, MAX(description), SUM(qty), SUM(revenue), SUM(quotes) FROM sales_daily GROUP BY 1""")
+    cur.execute("""INSERT INTO sales_daily_users(day, username, qty, revenue, quotes)
+                   SELECT substr(q.created_at, 1, 10), COALESCE(q.username, ''), SUM(qi.qty), SUM(qi.subtotal), COUNT(DISTINCT q.id)
+                   FROM quote_items qi JOIN quotes q ON q.id = qi.quote_id
+                   GROUP BY 1, 2""")
+    cur.execute("""INSERT INTO sales_daily_categories(day, category, qty, revenue, quotes)
+                   SELECT substr(q.created_at, 1, 10), COALESCE(TRIM(qi.category), ''), SUM(qi.qty), SUM(qi.subtotal), COUNT(DISTINCT q.id)
+                   FROM quote_items qi JOIN quotes q ON q.id = qi.quote_id
+                   GROUP BY 1, 2""")
+    return cur.execute("SELECT COUNT(*) FROM sales_daily").fetchone()[0]
+
+def _m007_sales_rollup(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS sales_daily(
+        day TEXT NOT NULL,
+        part_number TEXT NOT NULL,
+        username TEXT NOT NULL DEFAULT '',
+        category TEXT,
+        description TEXT,
+        qty INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        quotes INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(day, part_number, username)
+    )""")   # superseded by _m012_sales_rollups
+
+def rebuild_sales_rollup():
+    c = db(); cur = c.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        n = _fill_sales_rollup(cur)
+        cur.execute("UPDATE counters SET value = value + 1 WHERE name = 'sales_version'")
+        c.commit(); return n
+    except BaseException:
+        c.rollback(); raise
+    finally:
+        c.close()
+
+@app.cli.command("sales-rollup-rebuild")
+def sales_rollup_rebuild_cmd():
+    """Recompute the sales rollups from quotes/quote_items."""
+    print(f"sales_daily: {rebuild_sales_rollup()} row(s)")
+
+def _m008_stock_checkpoints(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS stock_checkpoint_runs(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        taken_at TEXT NOT NULL,
+        last_movement_id INTEGER NOT NULL DEFAULT 0
+    )""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS stock_checkpoints(
+        run_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        stock INTEGER NOT NULL,
+        PRIMARY KEY(run_id, item_id)
+    ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_checkpoint_runs_taken ON stock_checkpoint_runs(taken_at)")
+
+# Server-side carts: the session only carries `cart_id`; lines live here and the
+# triggers keep carts.total/lines current so nothing re-sums a cart per render.
+def _m009_carts(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS carts(
+        cart_id TEXT PRIMARY KEY,
+        updated_at TEXT NOT NULL,
+        total REAL NOT NULL DEFAULT 0,
+        lines INTEGER NOT NULL DEFAULT 0
+    )""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS cart_lines(
+        cart_id TEXT NOT NULL,
+        item_id INTEGER NOT NULL,
+        part_number TEXT NOT NULL,
+        description TEXT,
+        price REAL NOT NULL DEFAULT 0,
+        qty INTEGER NOT NULL,
+        PRIMARY KEY(cart_id, item_id)
+    ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_carts_updated ON carts(updated_at)")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS trg_cart_lines_ins AFTER INSERT ON cart_lines
+                    BEGIN UPDATE carts SET total = total + NEW.price * NEW.qty, lines = lines + 1 WHERE cart_id = NEW.cart_id; END""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS trg_cart_lines_del AFTER DELETE ON cart_lines
+                    BEGIN UPDATE carts SET total = total - OLD.price * OLD.qty, lines = lines - 1 WHERE cart_id = OLD.cart_id; END""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS trg_cart_lines_upd AFTER UPDATE OF price, qty ON cart_lines
+                    BEGIN UPDATE carts SET total = total + NEW.price * NEW.qty - OLD.price * OLD.qty WHERE cart_id = NEW.cart_id; END""")
+
+# counters.catalog_version goes up on every write to items (edits, imports, the
+# stock decrement in commit_sale), so it can serve as the catalog's ETag.
+def _m010_catalog_version(cur):
+    cur.execute("INSERT OR IGNORE INTO counters(name, value) VALUES('catalog_version', 1)")
+    for ev in ("INSERT", "UPDATE", "DELETE"):
+        cur.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_items_version_{ev.lower()[:3]} AFTER {ev} ON items
+                        BEGIN UPDATE counters SET value = value + 1 WHERE name = 'catalog_version'; END""")
+
+# Categories live in their own table; items.category_id points at it and
+# items.category keeps the canonical spelling for display/search. Spellings that
+# fold to the same key ("men", " Men ", "MEN") share one row. Row 0 stands for
+# Uncategorized, and the triggers keep per-category item/low-stock counts exact.
+def category_key(name: Optional[str]) -> str:
+    return " ".join(ar_fold(name).lower().split())
+
+def category_ref(cur, name: Optional[str]) -> Tuple[Optional[int], Optional[str]]:
+    """(id, canonical name) for a free-text category, created on first use; (None, None) when blank."""
+    key = category_key(name)
+    if not key: return None, None
+    cur.execute("INSERT OR IGNORE INTO categories(name, key) VALUES(?, ?)", (" ".join(name.split()), key))
+    r = cur.execute("SELECT id, name FROM categories WHERE key=?", (key,)).fetchone()
+    return r[0], r[1]
+
+def link_categories(cur) -> int:
+    """Point items that only have a free-text category at their categories row."""
+    names = [r[0] for r in cur.execute("""SELECT DISTINCT category FROM items
+                                         WHERE category_id IS NULL AND TRIM(COALESCE(category, '')) != ''""").fetchall()]
+    for name in names:
+        cid, canonical = category_ref(cur, name)
+        cur.execute("UPDATE items SET category_id=?, category=? WHERE category_id IS NULL AND category=?", (cid, canonical, name))
+    return len(names)
+
+def _m011_categories(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS categories(
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        key TEXT NOT NULL UNIQUE,
+        items INTEGER NOT NULL DEFAULT 0,
+        low_stock INTEGER NOT NULL DEFAULT 0
+    )""")
+    cur.execute("INSERT OR IGNORE INTO categories(id, name, key) VALUES(0, '', '')")
+    ensure_column(cur, "items", "category_id", "INTEGER REFERENCES categories(id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_items_category ON items(category_id, part_number COLLATE NOCASE, id)")
+    bucket = lambda t: f"COALESCE({t}category_id, 0)"
+    move = lambda t, op: (f"UPDATE categories SET items = items {op} 1, low_stock = low_stock {op} {low_stock_cond(t)} "
+                          f"WHERE id = {bucket(t)};")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_items_cat_ins AFTER INSERT ON items BEGIN {move('NEW.', '+')} END")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_items_cat_del AFTER DELETE ON items BEGIN {move('OLD.', '-')} END")
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_items_cat_upd AFTER UPDATE OF category_id, stock, min_stock ON items
+                    WHEN {bucket('NEW.')} != {bucket('OLD.')} OR {low_stock_cond('NEW.')} != {low_stock_cond('OLD.')}
+                    BEGIN {move('OLD.', '-')} {move('NEW.', '+')} END""")
+    cur.execute(f"""UPDATE categories SET
+                        items = (SELECT COUNT(*) FROM items WHERE {bucket('items.')} = categories.id),
+                        low_stock = (SELECT COUNT(*) FROM items WHERE {bucket('items.')} = categories.id AND {low_stock_cond('items.')})""")
+    link_categories(cur)
+
+def _m012_sales_rollups(cur):
+    # sales_daily was keyed by (day, part, user), which is nearly one row per sale line
+    cur.execute("DROP TABLE IF EXISTS sales_daily")
+    cur.execute("""CREATE TABLE sales_daily(
+        day TEXT NOT NULL,
+        part_number TEXT NOT NULL,
+        description TEXT,
+        qty INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        quotes INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(day, part_number)
+    ) WITHOUT ROWID""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS sales_parts(
+        part_number TEXT PRIMARY KEY,
+        description TEXT,
+        qty INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        quotes INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sales_parts_top ON sales_parts(qty DESC, revenue DESC)")
+    for table, col in (("sales_daily_users", "username"), ("sales_daily_categories", "category")):
+        cur.execute(f"""CREATE TABLE IF NOT EXISTS {table}(
+            day TEXT NOT NULL,
+            {col} TEXT NOT NULL DEFAULT '',
+            qty INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            quotes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(day, {col})
+        ) WITHOUT ROWID""")
+    # filled by _m014_quote_item_category, once sale lines carry their category
+
+# counters.sales_version keys the cached top-selling tables. It goes up with every
+# sale (_record_sale), a rollup rebuild, and item renames/deletes (the by-part
+# view shows current descriptions) -- but not with restocks or price edits.
+def _m013_sales_version(cur):
+    cur.execute("INSERT OR IGNORE INTO counters(name, value) VALUES('sales_version', 1)")
+    bump = "UPDATE counters SET value = value + 1 WHERE name = 'sales_version';"
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_items_sales_version_upd AFTER UPDATE OF part_number, description ON items
+                    WHEN NEW.part_number IS NOT OLD.part_number OR NEW.description IS NOT OLD.description
+                    BEGIN {bump} END""")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_items_sales_version_del AFTER DELETE ON items BEGIN {bump} END")
+
+# Append only: a step's position is its version number.
+# quote_items.category is the item's category at sale time, so rebuilding the
+# by-category rollup doesn't move past sales after a recategorisation or delete.
+# Older lines only have today's category to go on; deleted items stay uncategorized.
+def _m014_quote_item_category(cur):
+    ensure_column(cur, "quote_items", "category", "TEXT")
+    cur.execute("""UPDATE quote_items SET category = (SELECT category FROM items WHERE items.part_number = quote_items.part_number)
+                   WHERE category IS NULL""")
+    _fill_sales_rollup(cur)
+
+MIGRATIONS = [_m001_base, _m002_image_paths, _m003_indexes, _m004_low_stock, _m005_search,
+              _m006_pdf_jobs, _m007_sales_rollup, _m008_stock_checkpoints, _m009_carts,
+              _m010_catalog_version, _m011_categories, _m012_sales_rollups,
+              _m013_sales_version, _m014_quote_item_category]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def schema_version() -> int:
+    """Current PRAGMA user_version; also picks up whether the FTS index exists."""
+    global FTS_OK
+    c = db()
+    v, fts = c.execute("""SELECT (SELECT user_version FROM pragma_user_version),
+                                 EXISTS(SELECT 1 FROM sqlite_master WHERE name='items_fts')""").fetchone()
     c.close()
-normalize_image_paths()
+    FTS_OK = bool(fts)
+    return v
+
+def migrate(log=None) -> int:
+    """Apply pending migrations one transaction each; returns the resulting version."""
+    c = _connect(); c.execute("PRAGMA busy_timeout=600000")   # wait out another migrator
+    try:
+        while True:
+            c.execute("BEGIN IMMEDIATE")
+            v = c.execute("PRAGMA user_version").fetchone()[0]
+            if v >= SCHEMA_VERSION:
+                c.rollback(); break
+            step = MIGRATIONS[v]
+            try:
+                step(c.cursor()); c.execute(f"PRAGMA user_version={v + 1}"); c.commit()
+            except BaseException:
+                c.rollback(); raise
+            if log: log(f"migrated to {v + 1}: {step.__name__}")
+    finally:
+        sqlite3.Connection.close(c)
+    return schema_version()
+
+@app.cli.command("db-migrate")
+def db_migrate_cmd():
+    """Bring the database schema up to date."""
+    v = migrate(log=print)
+    print(f"schema at version {v}")
+
+if schema_version() < SCHEMA_VERSION:
+    if DB_AUTO_MIGRATE: migrate()
+    else: app.logger.warning("database schema is behind (version %s < %s); run `flask --app d db-migrate`",
+                             schema_version(), SCHEMA_VERSION)
+
+# Generated files are named by content hash and sharded by its first two hex
+# digits, e.g. static/images/3f/3fa1...-thumb.webp or static/quotes/9c/9c04....pdf,
+# so a URL never changes meaning and can be cached forever.
+def sharded_path(base_dir: str, h: str, name: str) -> str:
+    d = os.path.join(base_dir, h[:2]).replace("\\", "/")
+    os.makedirs(d, exist_ok=True)
+    return f"{d}/{name}"
+
+def write_atomic(dest: str, data: bytes):
+    tmp = f"{dest}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "wb") as f: f.write(data)
+    os.replace(tmp, dest)
+
+def store_blob(data: bytes, base_dir: str, ext: str) -> str:
+    """Write `data` under its content hash; identical content maps to the same file."""
+    h = hashlib.sha256(data).hexdigest()[:16]
+    dest = sharded_path(base_dir, h, f"{h}.{ext}")
+    if not os.path.exists(dest): write_atomic(dest, data)
+    return dest
+
+# Uploads are re-encoded into <sha>-<size>.<fmt> variants (EXIF dropped,
+# orientation applied); items.image_path points at the full JPEG.
+def _hashed_variant(p: str):
+    name = os.path.basename(p); stem, ext = os.path.splitext(name)
+    h, _, size = stem.rpartition("-")
+    if len(h) == 16 and size in IMAGE_SIZES and ext[1:] in IMAGE_FORMATS: return os.path.dirname(p), h
+    return None
+
+def store_image(data: bytes) -> Optional[str]:
+    if not PIL_OK: return None
+    try:
+        im = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    except Exception:
+        return None
+    h = hashlib.sha256(data).hexdigest()[:16]
+    alpha = im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info)
+    im = im.convert("RGBA" if alpha else "RGB")
+    for size, edge in IMAGE_SIZES.items():
+        v = im.copy(); v.thumbnail((edge, edge), Image.LANCZOS)
+        flat = v
+        if alpha:
+            flat = Image.new("RGB", v.size, "white"); flat.paste(v, mask=v.getchannel("A"))
+        for ext, fmt in IMAGE_FORMATS.items():
+            dest = sharded_path(IMG_DIR, h, f"{h}-{size}.{ext}")
+            if os.path.exists(dest): continue
+            buf = io.BytesIO()
+            (v if fmt == "WEBP" else flat).save(buf, fmt, quality=82, optimize=True, **({"method": 4} if fmt == "WEBP" else {"progressive": True}))
+            write_atomic(dest, buf.getvalue())
+    return sharded_path(IMG_DIR, h, f"{h}-full.jpg")
+
+def backfill_image_variants() -> Tuple[int, int]:
+    """Generate variants for images stored before the pipeline existed."""
+    c = db(); cur = c.cursor()
+    cur.execute("SELECT id, image_path FROM items WHERE image_path IS NOT NULL AND image_path != ''")
+    rows = cur.fetchall()
+    done = failed = 0
+    for r in rows:
+        p = r["image_path"].replace("\\","/")
+        if _hashed_variant(p): continue
+        try:
+            with open(p, "rb") as f: data = f.read()
+        except OSError:
+            failed += 1; continue
+        fixed = store_image(data)
+        if not fixed: failed += 1; continue
+        cur.execute("UPDATE items SET image_path=? WHERE id=?", (fixed, r["id"])); done += 1
+    if done: c.commit()
+    c.close()
+    return done, failed
+
+@app.cli.command("images-backfill")
+def images_backfill_cmd():
+    """Create thumbnail/card/full WebP+JPEG variants for existing item images."""
+    done, failed = backfill_image_variants()
+    print(f"converted {done} image(s), {failed} skipped")
+
+# Fingerprinted files get a year-long immutable Cache-Control; everything else
+# keeps Flask's revalidating default. With DSHOP_SENDFILE the worker only sends
+# headers and the front proxy streams the bytes: "x-sendfile" (Apache/lighttpd)
+# or "x-accel:/prefix/" (nginx `internal` location aliased to static/).
+FINGERPRINTED = re.compile(r"^(images|quotes)/([0-9a-f]{2}/)?[0-9a-f]{16}(-(thumb|card|full))?\.(webp|jpg|pdf)$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+app.config["USE_X_SENDFILE"] = STATIC_SENDFILE == "x-sendfile"
+
+def static_file(filename):
+    if STATIC_SENDFILE.startswith("x-accel:"):
+        path = safe_join(app.static_folder, filename)
+        if not path or not os.path.isfile(path): abort(404)
+        resp = Response(mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+        resp.headers["X-Accel-Redirect"] = STATIC_SENDFILE[len("x-accel:"):].rstrip("/") + "/" + filename
+    else:
+        resp = app.send_static_file(filename)
+    if FINGERPRINTED.match(filename): resp.headers["Cache-Control"] = IMMUTABLE
+    return resp
+
+app.view_functions["static"] = static_file
 
 # --------------- Auth helpers --------------
 def current_user():
@@ -159,9 +834,11 @@ def require_role(*roles):
     return bool(u and u["role"] in roles)
 
 # --------------- Utility -------------------
-def img_public_url(p: Optional[str]) -> str:
+def img_public_url(p: Optional[str], size: Optional[str] = None, fmt: str = "jpg") -> str:
     if not p: return ""
     p = p.replace("\\","/")
+    hv = _hashed_variant(p) if size else None
+    if hv: p = f"{hv[0]}/{hv[1]}-{size}.{fmt}"
     if p.startswith("static/"): return "/" + p
     if "/static/" in p:
         s = p[p.find("/static/"):]
@@ -169,39 +846,381 @@ def img_public_url(p: Optional[str]) -> str:
     fname = os.path.basename(p)
     return f"/static/images/{fname}" if fname else ""
 
-def register_ar_font():
-    candidates = [
-        os.path.join(FONTS_DIR,"NotoNaskhArabic-Regular.ttf"),
-        os.path.join(FONTS_DIR,"Amiri-Regular.ttf"),
-        os.path.join(FONTS_DIR,"ScheherazadeNew-Regular.ttf"),
-        os.path.join(FONTS_DIR,"Arial.ttf"),
-        os.path.join(FONTS_DIR,"Tahoma.ttf"),
-    ]
-    win_fonts = os.path.join(os.environ.get("WINDIR","C:\\Windows"), "Fonts")
-    for f in ["NotoNaskhArabic-Regular.ttf","Amiri-Regular.ttf","ScheherazadeNew-Regular.ttf",
-              "Tahoma.ttf","Arial.ttf","Times New Roman.ttf"]:
-        candidates.append(os.path.join(win_fonts, f))
-    for path in candidates:
-        try:
-            if os.path.exists(path):
-                name = os.path.splitext(os.path.basename(path))[0]
-                pdfmetrics.registerFont(TTFont(name, path))
-                return name
-        except Exception:
-            continue
-    return None
+@lru_cache(maxsize=8192)
+def _variant_width(path: str) -> Optional[int]:
+    """Pixel width of a stored variant (IMAGE_SIZES bounds the longest edge, not the
+    width). Variant files are content-addressed and never rewritten, so this is cached for good."""
+    if not PIL_OK: return None
+    try:
+        with Image.open(path) as im: return im.width
+    except Exception:
+        return None
+
+def img_srcset(p: Optional[str], fmt: str = "jpg", sizes=("thumb", "card")) -> str:
+    """`srcset` with each variant's real width; empty for legacy uploads without variants."""
+    hv = _hashed_variant(p.replace("\\","/")) if p else None
+    if not hv: return ""
+    out = {}
+    for s in sizes:
+        w = _variant_width(f"{hv[0]}/{hv[1]}-{s}.{fmt}")
+        if w is None: return ""
+        out.setdefault(w, f"{img_public_url(p, s, fmt)} {w}w")   # small originals: thumb and card can be the same width
+    return ", ".join(out.values())
+
+app.jinja_env.globals.update(img_url=img_public_url, img_srcset=img_srcset)
+
+def date_range(col: str, start: Optional[str], end: Optional[str]) -> Tuple[list, list]:
+    """Index-friendly inclusive day filter on a 'YYYY-MM-DD HH:MM:SS' column."""
+    where, params = [], []
+    if start: where.append(f"{col} >= ?"); params.append(start)
+    if end: where.append(f"{col} < date(?, '+1 day')"); params.append(end)
+    return where, params
+
+# ---- Keyset pagination ----
+PAGE_SIZES = (24, 48, 96, 200)
+
+def page_size(default: int = 48) -> int:
+    try: n = int(request.args.get("n", default))
+    except ValueError: n = default
+    return max(1, min(n, PAGE_SIZES[-1]))
+
+def encode_cursor(vals) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(vals), ensure_ascii=False).encode()).decode().rstrip("=")
+
+def decode_cursor(s: Optional[str], size: int) -> Optional[list]:
+    if not s: return None
+    try: vals = json.loads(base64.urlsafe_b64decode(s + "=" * (-len(s) % 4)))
+    except Exception: return None
+    if not isinstance(vals, list) or len(vals) != size: return None
+    # only scalars can be bound; anything else is a tampered cursor, treated as "first page"
+    return vals if all(v is None or isinstance(v, (str, int, float)) for v in vals) else None
+
+def page_url(**cursor) -> str:
+    args = {k: v for k, v in request.args.items() if k not in ("after", "before")}
+    return url_for(request.endpoint, **(request.view_args or {}), **args, **cursor)
+
+def keyset_page(cur, base_q: str, where: list, params: list, order: list, fields: list, n: int, desc: bool = False):
+    """Fetch one page of base_q ordered by the `order` expressions (a unique key,
+    e.g. [sort column, id]). `fields` are the matching row keys used to build
+    cursors. Reads ?after=/?before= and returns (rows, pager)."""
+    after = decode_cursor(request.args.get("after"), len(order))
+    before = None if after else decode_cursor(request.args.get("before"), len(order))
+    back = before is not None; key = after or before
+    op = "<" if desc != back else ">"
+    where = list(where); params = list(params)
+    if key:
+        # leading-column bound lets SQLite seek the index; the row value settles ties
+        where.append(f"{order[0]} {op}= ? AND ({', '.join(order)}) {op} ({', '.join('?' * len(order))})")
+        params += [key[0], *key]
+    q = base_q + (" WHERE " + " AND ".join(where) if where else "")
+    q += " ORDER BY " + ", ".join(f"{o} {'DESC' if op == '<' else 'ASC'}" for o in order) + " LIMIT ?"
+    rows = cur.execute(q, (*params, n + 1)).fetchall()
+    more = len(rows) > n; rows = rows[:n]
+    if back: rows.reverse()
+    has_next, has_prev = (True, more) if back else (more, key is not None)
+    pager = {"n": n, "sizes": sorted({*PAGE_SIZES, n}),   # a hand-typed ?n= still shows as selected
+             "next": page_url(after=encode_cursor(rows[-1][f] for f in fields)) if rows and has_next else None,
+             "prev": page_url(before=encode_cursor(rows[0][f] for f in fields)) if rows and has_prev else None}
+    return rows, pager
 
-def get_low_stock_count_and_list() -> Tuple[int, list]:
+def low_stock_count() -> int:
+    c = db(); r = c.execute("SELECT value FROM counters WHERE name='low_stock'").fetchone(); c.close()
+    return int(r[0]) if r else 0
+
+def catalog_version() -> int:
+    c = db(); r = c.execute("SELECT value FROM counters WHERE name='catalog_version'").fetchone(); c.close()
+    return int(r[0]) if r else 0
+
+def sales_version() -> int:
+    c = db(); r = c.execute("SELECT value FROM counters WHERE name='sales_version'").fetchone(); c.close()
+    return int(r[0]) if r else 0
+
+def low_stock_rows() -> list:
     c = db(); cur = c.cursor()
-    cur.execute("""SELECT id, part_number, description, price, stock, min_stock, image_path
-                   FROM items
-                   WHERE (stock IS NOT NULL AND min_stock IS NOT NULL AND stock <= min_stock) OR (stock IS NULL OR stock = 0)
-                   ORDER BY stock ASC, part_number COLLATE NOCASE""")
+    cur.execute(f"""SELECT id, part_number, description, price, stock, min_stock, category, image_path
+                    FROM items
+                    WHERE {low_stock_cond()}
+                    ORDER BY stock ASC, part_number COLLATE NOCASE""")
     rows = cur.fetchall(); c.close()
-    return len(rows), rows
+    return rows
+
+# --------------- PDF jobs -----------------
+# Checkout only records the sale and queues a row in pdf_jobs. Rendering happens
+# on background threads inside each worker (DSHOP_PDF_THREADS, default 1; 0 under
+# gunicorn.conf.py) and/or in a separate `flask --app d pdf-worker` process (the
+# Procfile's worker); jobs live in SQLite, so a crashed render is picked up again
+# once it goes stale.
+PDF_THREADS = int(os.environ.get("DSHOP_PDF_THREADS", "1"))
+PDF_MAX_ATTEMPTS = 3
+PDF_STALE_SECS = 300
+_pdf_wake = threading.Event(); _pdf_threads = []; _pdf_threads_lock = threading.Lock()
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def enqueue_pdf(cur, quote_id: int):
+    cur.execute("INSERT OR REPLACE INTO pdf_jobs(quote_id,status,attempts,created_at) VALUES(?,'pending',0,?)", (quote_id, _now()))
+
+def _claim_pdf_job(c) -> Optional[int]:
+    stale = (datetime.now() - timedelta(seconds=PDF_STALE_SECS)).strftime("%Y-%m-%d %H:%M:%S")
+    r = c.execute("""UPDATE pdf_jobs SET status='running', started_at=?, attempts=attempts+1
+                     WHERE quote_id = (SELECT quote_id FROM pdf_jobs
+                                       WHERE status='pending' OR (status='running' AND started_at < ?)
+                                       ORDER BY quote_id LIMIT 1)
+                     RETURNING quote_id""", (_now(), stale)).fetchone()
+    c.commit()
+    return r[0] if r else None
+
+def timed_render_quote(quote: dict, out) -> float:
+    t0 = time.perf_counter()
+    try: return render_quote(quote, out, FONTS_DIR)
+    finally: PDF_RENDER_SECONDS.observe(time.perf_counter() - t0)
+
+def render_pdf_job(quote_id: int) -> Optional[str]:
+    c = db(); cur = c.cursor()
+    try:
+        q = cur.execute("SELECT * FROM quotes WHERE id=?", (quote_id,)).fetchone()
+        if not q:
+            cur.execute("DELETE FROM pdf_jobs WHERE quote_id=?", (quote_id,)); c.commit(); return None
+        lines = cur.execute("SELECT part_number,description,qty,price FROM quote_items WHERE quote_id=? ORDER BY id", (quote_id,)).fetchall()
+        buf = io.BytesIO(); timed_render_quote(quote_from_rows(q, lines), buf)
+        out_path = store_blob(buf.getvalue(), QUOTE_DIR, "pdf")
+        cur.execute("UPDATE quotes SET file_path=? WHERE id=?", (out_path, quote_id))
+        cur.execute("UPDATE pdf_jobs SET status='done', finished_at=?, error=NULL WHERE quote_id=?", (_now(), quote_id))
+        c.commit(); return out_path
+    except Exception as e:
+        c.rollback()
+        cur.execute("UPDATE pdf_jobs SET status=CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error=? WHERE quote_id=?",
+                    (PDF_MAX_ATTEMPTS, f"{type(e).__name__}: {e}"[:500], quote_id))
+        c.commit(); return None
+    finally:
+        c.close()
+
+def drain_pdf_jobs(limit: Optional[int] = None) -> int:
+    done = 0
+    while limit is None or done < limit:
+        c = db()
+        try: qid = _claim_pdf_job(c)
+        finally: c.close()
+        if qid is None: break
+        render_pdf_job(qid); done += 1
+    return done
+
+def _pdf_worker_loop():
+    while True:
+        _pdf_wake.wait(timeout=30); _pdf_wake.clear()
+        try: drain_pdf_jobs()
+        except Exception: app.logger.exception("pdf worker: draining jobs failed")
+
+def wake_pdf_workers():
+    with _pdf_threads_lock:
+        _pdf_threads[:] = [t for t in _pdf_threads if t.is_alive()]
+        while len(_pdf_threads) < PDF_THREADS:
+            t = threading.Thread(target=_pdf_worker_loop, name="pdf-worker", daemon=True); t.start(); _pdf_threads.append(t)
+    _pdf_wake.set()
+
+_pdf_started_pid = None
+
+@app.before_request
+def _start_pdf_workers():
+    """Start this process's render threads on its first request (after any fork),
+    so jobs left pending or stale by a restart don't wait for the next sale."""
+    global _pdf_started_pid
+    if PDF_THREADS and _pdf_started_pid != os.getpid():
+        _pdf_started_pid = os.getpid(); wake_pdf_workers()
+
+@app.cli.command("pdf-worker")
+@click.option("--once", is_flag=True, help="Drain pending jobs and exit.")
+def pdf_worker_cmd(once):
+    """Render queued quotation PDFs."""
+    while True:
+        n = drain_pdf_jobs()
+        if n: print(f"rendered {n} quote PDF(s)")
+        if once: break
+        time.sleep(2)
+
+# --------------- Stock ledger -----------------
+# Every stock change is a movements row, so stock at any past moment is a
+# checkpoint plus a replay. Checkpoints snapshot every item's stock together
+# with the movement id high-water mark; take them periodically (cron) with
+# `flask --app d stock-checkpoint`.
+def log_movement(c, item_id, part_number, qty_change, reason, ref_quote_id=None, note=None):
+    c.execute("""INSERT INTO movements(created_at,item_id,part_number,qty_change,reason,ref_quote_id,note)
+                 VALUES(?,?,?,?,?,?,?)""", (_now(), item_id, part_number, qty_change, reason, ref_quote_id, note))
+
+def take_stock_checkpoint() -> int:
+    c = db(); cur = c.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        last = cur.execute("SELECT COALESCE(MAX(id), 0) FROM movements").fetchone()[0]
+        cur.execute("INSERT INTO stock_checkpoint_runs(taken_at, last_movement_id) VALUES(?, ?)", (_now(), last))
+        run_id = cur.lastrowid
+        cur.execute("INSERT INTO stock_checkpoints(run_id, item_id, stock) SELECT ?, id, COALESCE(stock, 0) FROM items", (run_id,))
+        c.commit(); return run_id
+    except BaseException:
+        c.rollback(); raise
+    finally:
+        c.close()
+
+@app.cli.command("stock-checkpoint")
+def stock_checkpoint_cmd():
+    """Snapshot every item's stock (run daily/weekly from cron)."""
+    print(f"checkpoint #{take_stock_checkpoint()}")
+
+def stock_levels_at(day: str, item_ids: Optional[list] = None) -> dict:
+    """Stock per item id at the end of `day` (YYYY-MM-DD), replayed from whichever
+    checkpoint (or the live stock) is closest in time."""
+    end = (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+    ids_sql = f" AND item_id IN ({','.join('?' * len(item_ids))})" if item_ids is not None else ""
+    ids = list(item_ids or [])
+    c = db(); cur = c.cursor()
+    before = cur.execute("SELECT * FROM stock_checkpoint_runs WHERE taken_at < ? ORDER BY taken_at DESC LIMIT 1", (end,)).fetchone()
+    after = cur.execute("SELECT * FROM stock_checkpoint_runs WHERE taken_at >= ? ORDER BY taken_at LIMIT 1", (end,)).fetchone()
+    gap = lambda t: abs((datetime.strptime(t[:19], "%Y-%m-%d %H:%M:%S") - datetime.strptime(end, "%Y-%m-%d")).total_seconds())
+    if before and gap(before["taken_at"]) <= gap(after["taken_at"] if after else _now()):
+        # forward: checkpoint + movements after it, up to the end of the day
+        base = dict(cur.execute(f"SELECT item_id, stock FROM stock_checkpoints WHERE run_id=?{ids_sql}", (before["id"], *ids)).fetchall())
+        delta = cur.execute(f"""SELECT item_id, SUM(qty_change) FROM movements
+                                WHERE created_at >= ? AND created_at < ? AND id > ?{ids_sql} GROUP BY item_id""",
+                            (before["taken_at"][:10], end, before["last_movement_id"], *ids)).fetchall()
+    else:
+        # backward: later checkpoint (or live stock) minus movements since the end of the day
+        if after:
+            base = dict(cur.execute(f"SELECT item_id, stock FROM stock_checkpoints WHERE run_id=?{ids_sql}", (after["id"], *ids)).fetchall())
+            bound, params = " AND created_at <= ? AND id <= ?", (after["taken_at"], after["last_movement_id"])
+        else:
+            base = dict(cur.execute(f"SELECT id AS item_id, COALESCE(stock, 0) FROM items WHERE 1=1{ids_sql.replace('item_id', 'id')}", ids).fetchall())
+            bound, params = "", ()
+        delta = cur.execute(f"""SELECT item_id, -SUM(qty_change) FROM movements
+                                WHERE created_at >= ?{bound}{ids_sql} GROUP BY item_id""", (end, *params, *ids)).fetchall()
+    c.close()
+    levels = {i: 0 for i in ids}; levels.update(base)
+    for item_id, d in delta:
+        if item_id is not None: levels[item_id] = levels.get(item_id, 0) + int(d or 0)
+    return levels
+
+# --------------- Sales -----------------
+class OutOfStock(Exception):
+    """Raised by commit_sale() with the part number that no longer has enough stock."""
+
+def _record_sale(cur, quote: dict) -> int:
+    lines = quote["lines"]; ids = [l["item_id"] for l in lines]
+    # stock >= qty in the WHERE is the oversell guard; a short rowcount means a line lost
+    cur.execute("SAVEPOINT sale_stock")
+    cur.executemany("UPDATE items SET stock = stock - ? WHERE id = ? AND stock >= ?",
+                    [(l["qty"], l["item_id"], l["qty"]) for l in lines])
+    if cur.rowcount != len(lines):
+        cur.execute("ROLLBACK TO sale_stock"); cur.execute("RELEASE sale_stock")
+        have = {r["id"]: r["stock"] for r in cur.execute(f"SELECT id, stock FROM items WHERE id IN ({','.join('?' * len(ids))})", ids)}
+        bad = next((l for l in lines if l["item_id"] not in have or l["qty"] > int(have[l["item_id"]] or 0)), lines[0])
+        raise OutOfStock(bad["part"])
+    cur.execute("RELEASE sale_stock")
+    info = cur.execute(f"SELECT id, part_number, category FROM items WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+    parts = {r["id"]: r["part_number"] for r in info}; cats = {r["id"]: r["category"] for r in info}
+    cur.execute("""INSERT INTO quotes(created_at,username,customer_name,customer_phone,customer_notes,total,file_path)
+                   VALUES(?,?,?,?,?,?,NULL)""",
+                (quote["created_at"], quote["username"], quote["customer_name"], quote["customer_phone"],
+                 quote["customer_notes"], quote_total(quote)))
+    qid = cur.lastrowid
+    cur.executemany("""INSERT INTO quote_items(quote_id,part_number,description,qty,price,subtotal,category) VALUES(?,?,?,?,?,?,?)""",
+                    [(qid, parts[l["item_id"]], l["desc"], l["qty"], l["price"], l["price"] * l["qty"], cats[l["item_id"]])
+                     for l in lines])
+    cur.executemany("""INSERT INTO movements(created_at,item_id,part_number,qty_change,reason,ref_quote_id,note)
+                       VALUES(?,?,?,?,'sale',?,NULL)""",
+                    [(quote["created_at"], l["item_id"], parts[l["item_id"]], -l["qty"], qid) for l in lines])
+    day = quote["created_at"][:10]
+    per_part = [(parts[l["item_id"]], l["desc"], l["qty"], l["price"] * l["qty"]) for l in lines]
+    cur.executemany("""INSERT INTO sales_daily(day, part_number, description, qty, revenue, quotes) VALUES(?,?,?,?,?,1)
+                       ON CONFLICT(day, part_number) DO UPDATE SET
+                           qty = qty + excluded.qty, revenue = revenue + excluded.revenue, quotes = quotes + 1,
+                           description = excluded.description""", [(day, *p) for p in per_part])
+    cur.executemany("""INSERT INTO sales_parts(part_number, description, qty, revenue, quotes) VALUES(?,?,?,?,1)
+                       ON CONFLICT(part_number) DO UPDATE SET
+                           qty = qty + excluded.qty, revenue = revenue + excluded.revenue, quotes = quotes + 1,
+                           description = excluded.description""", per_part)
+    by_cat = {}
+    for l in lines:
+        t = by_cat.setdefault((cats[l["item_id"]] or "").strip(), [0, 0.0]); t[0] += l["qty"]; t[1] += l["price"] * l["qty"]
+    for table, col, totals in (("sales_daily_users", "username", {quote["username"] or "": [sum(l["qty"] for l in lines), quote_total(quote)]}),
+                               ("sales_daily_categories", "category", by_cat)):
+        cur.executemany(f"""INSERT INTO {table}(day, {col}, qty, revenue, quotes) VALUES(?,?,?,?,1)
+                            ON CONFLICT(day, {col}) DO UPDATE SET
+                                qty = qty + excluded.qty, revenue = revenue + excluded.revenue, quotes = quotes + 1""",
+                        [(day, k, q, r) for k, (q, r) in totals.items()])
+    cur.execute("UPDATE counters SET value = value + 1 WHERE name = 'sales_version'")
+    enqueue_pdf(cur, qid)
+    if quote.get("cart_id"): cart_clear_lines(cur, quote["cart_id"])
+    return qid
+
+def commit_sale(quote: dict) -> int:
+    """Record a sale atomically: quote row, guarded stock decrements, quote_items/
+    movements in batches, the rollup and the PDF job (and empty the quote's
+    `cart_id`, if any). Returns the quote id; raises OutOfStock (and writes
+    nothing) if any line can't be served."""
+    return db_write(_record_sale, quote)
 
 # --------------- Templates -----------------
 # (moved to /templates files)
+
+# ---- Fragment cache ----
+# HTML that is the same for every user is rendered once per worker and kept in
+# a byte-bounded LRU: item cards keyed by the row values they display, report
+# tables by data version + query: low stock by catalog_version, which every item
+# write bumps through the triggers, top selling by sales_version, which only
+# sales and item renames bump. All workers miss on their next request after a
+# relevant write; stale entries just age out. The navbar, cart and admin-only
+# controls are rendered around the fragments per request.
+FRAGMENT_CACHE_BYTES = int(float(os.environ.get("DSHOP_FRAGMENT_CACHE_MB", "16")) * 2**20)   # 0 disables
+
+class FragmentCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes; self.bytes = 0
+        self._entries = OrderedDict(); self._lock = threading.Lock()
+        self.hits = {}; self.misses = {}; self.evictions = 0
+
+    def get(self, kind: str, key, render) -> Markup:
+        """Cached HTML for (kind, key); render() produces it on a miss."""
+        if self.max_bytes <= 0: return Markup(render())
+        k = (kind, key)
+        with self._lock:
+            html = self._entries.get(k)
+            if html is not None:
+                self._entries.move_to_end(k); self.hits[kind] = self.hits.get(kind, 0) + 1
+                return html
+            self.misses[kind] = self.misses.get(kind, 0) + 1
+        html = Markup(render())
+        with self._lock:
+            old = self._entries.pop(k, None)
+            if old is not None: self.bytes -= len(old)
+            self._entries[k] = html; self.bytes += len(html)
+            while self.bytes > self.max_bytes and self._entries:
+                _, dropped = self._entries.popitem(last=False)
+                self.bytes -= len(dropped); self.evictions += 1
+        return html
+
+    def clear(self):
+        with self._lock: self._entries.clear(); self.bytes = 0
+
+    def stats(self) -> dict:
+        """A consistent snapshot of the counters; get() keeps updating them on other threads."""
+        with self._lock:
+            return {"hits": dict(self.hits), "misses": dict(self.misses), "evictions": self.evictions,
+                    "entries": len(self._entries), "bytes": self.bytes}
+
+    def __len__(self): return len(self._entries)
+
+fragments = FragmentCache(FRAGMENT_CACHE_BYTES)
+CARD_FIELDS = ("id", "part_number", "description", "price", "stock", "min_stock", "category", "image_path")
+
+def fragment_macro(name: str):
+    return get_template_attribute("_fragments.html", name)
+
+def item_card(it) -> Markup:
+    """Image and body of a catalog card; identical rows share one rendering."""
+    return fragments.get("card", tuple(it[f] for f in CARD_FIELDS), lambda: fragment_macro("item_card")(it))
+
+app.jinja_env.globals.update(item_card=item_card)
+
 # --------------- Routes -----------------
 @app.route("/login", methods=["GET","POST"])
 def login():
@@ -212,7 +1231,7 @@ def login():
             flash(f"Signed in as {u} ({USERS[u]['role']})","success")
             return redirect(url_for("home"))
         flash("Invalid credentials","danger")
-    low_count, _ = get_low_stock_count_and_list()
+    low_count = low_stock_count()
     return render_template("login.html", title=APP_TITLE, u=current_user(), low_count=low_count)
 
 @app.route("/logout")
@@ -220,39 +1239,72 @@ def logout():
     session.clear(); flash("Signed out","info"); return redirect(url_for("home"))
 
 
-@app.route("/")
-def home():
-    q = request.args.get("q","").strip().lower()
-    cat = request.args.get("cat","").strip()
-    c = db(); cur = c.cursor()
-    # categories
-    cur.execute("SELECT DISTINCT COALESCE(NULLIF(TRIM(category),''),'Uncategorized') AS category FROM items ORDER BY category COLLATE NOCASE")
-    cats = [r[0] for r in cur.fetchall()]
-    # items
+def catalog_query(q: str, cat: str):
+    """Search/category filter shared by home() and /api/items, as keyset_page() arguments."""
     base_q = "SELECT * FROM items"
     where = []; params = []
-    if q:
+    order = ["items.part_number COLLATE NOCASE", "items.id"]; fields = ["part_number", "id"]
+    match = fts_query(q) if q and FTS_OK else ""
+    if match:
+        base_q = "SELECT items.*, items_fts.rank AS _rank FROM items_fts JOIN items ON items.id = items_fts.rowid"
+        where.append("items_fts MATCH ?"); params += [match]
+        order = ["items_fts.rank", "items.id"]; fields = ["_rank", "id"]
+    elif q:
         where.append("(LOWER(part_number) LIKE ? OR LOWER(description) LIKE ?)")
         params += [f"%{q}%", f"%{q}%"]
     if cat and cat.lower() != "all":
         if cat.lower() == "uncategorized":
-            where.append("(category IS NULL OR TRIM(category)='')")
+            where.append("items.category_id IS NULL")
         else:
-            where.append("LOWER(category)=?"); params += [cat.lower()]
-    if where: base_q += " WHERE " + " AND ".join(where)
-    base_q += " ORDER BY part_number COLLATE NOCASE"
-    cur.execute(base_q, tuple(params)); items = cur.fetchall(); c.close()
-    items_ui = []
-    for r in items:
-        d = dict(r); d["image_url"] = img_public_url(d.get("image_path")); items_ui.append(d)
-    cart_total = sum((float(it["price"] or 0) * int(it["qty"])) for it in session.get("cart", {}).values())
-    low_count, _ = get_low_stock_count_and_list()
-    return render_template("home.html", title=APP_TITLE, items=items_ui, u=current_user(), query=q, cart_total=cart_total, low_count=low_count, categories=cats, selected_cat=cat or "All")
+            c = db(); r = c.execute("SELECT id FROM categories WHERE key=?", (category_key(cat),)).fetchone(); c.close()
+            where.append("items.category_id = ?"); params += [r[0] if r else -1]
+    return base_q, where, params, order, fields
+
+def category_counts() -> list:
+    """Sidebar rows (name, items, low_stock) straight from the trigger-maintained table."""
+    c = db()
+    rows = c.execute("""SELECT CASE id WHEN 0 THEN 'Uncategorized' ELSE name END AS name, items, low_stock
+                        FROM categories WHERE items > 0 ORDER BY id = 0, name COLLATE NOCASE""").fetchall()
+    c.close()
+    return [dict(r) for r in rows]
+
+@app.route("/")
+def home():
+    q = request.args.get("q","").strip().lower()
+    cat = request.args.get("cat","").strip()
+    c = db(); cur = c.cursor()
+    cats = category_counts()
+    base_q, where, params, order, fields = catalog_query(q, cat)
+    items, pager = keyset_page(cur, base_q, where, params, order, fields, page_size()); c.close()
+    cart_total = cart_summary()[0]
+    low_count = low_stock_count()
+    return render_template("home.html", title=APP_TITLE, items=items, u=current_user(), query=q, cart_total=cart_total, low_count=low_count, categories=cats, selected_cat=cat or "All", pager=pager)
+
+ITEM_FIELDS = ("part", "desc", "price", "stock", "min_stock", "category")
+
+def validate_item(raw, partial: bool = False) -> Tuple[Optional[dict], Optional[str]]:
+    """Validate item fields keyed by form name (part, desc, price, stock, min_stock,
+    category). With partial=True blank fields come back as None ("leave as is")."""
+    v = {k: "" if raw.get(k) is None else str(raw.get(k)).strip() for k in ITEM_FIELDS}
+    if not v["part"]: return None, "Part number is required"
+    try: price = float(Decimal(v["price"])) if v["price"] else None
+    except (InvalidOperation, ValueError): return None, "Invalid price"
+    try:
+        stock = int(v["stock"] or "0") if v["stock"] or not partial else None
+        min_stock = int(v["min_stock"] or "0") if v["min_stock"] or not partial else None
+    except ValueError:
+        return None, "Stock/min stock must be integers"
+    blank = None if partial else ""
+    return {"part": v["part"], "desc": v["desc"] or blank, "price": price, "stock": stock,
+            "min_stock": min_stock, "category": v["category"] or blank}, None
 
 def _save_upload(file_storage, part_number):
     if not file_storage or not file_storage.filename: return None
     ext = os.path.splitext(file_storage.filename)[1].lower()
     if ext.replace(".","") not in ALLOWED_EXT: return None
+    stored = store_image(file_storage.read())
+    if stored: return stored
+    file_storage.stream.seek(0)
     safe = secure_filename(part_number) or uuid.uuid4().hex
     fname = f"{safe}-{uuid.uuid4().hex[:6]}{ext}"
     dest = os.path.join(IMG_DIR, fname)
@@ -264,31 +1316,21 @@ def item_new():
     if not require_role("admin","standard"):
         flash("Sign in to add items.","warning"); return redirect(url_for("home"))
     if request.method == "POST":
-        part = request.form.get("part","").strip()
-        desc = request.form.get("desc","").strip()
-        price_raw = request.form.get("price","").strip()
-        stock_raw = request.form.get("stock","0").strip()
-        min_stock_raw = request.form.get("min_stock","0").strip()
-        category = request.form.get("category","").strip()
+        f, err = validate_item(request.form)
+        if err: flash(err,"danger"); return redirect(request.url)
+        part, desc, price, stock, min_stock, category = f["part"], f["desc"], f["price"], f["stock"], f["min_stock"], f["category"]
         img = request.files.get("image")
-        if not part:
-            flash("Part number is required","danger"); return redirect(request.url)
-        try: price = float(Decimal(price_raw)) if price_raw else None
-        except (InvalidOperation, ValueError):
-            flash("Invalid price","danger"); return redirect(request.url)
-        try: stock = int(stock_raw); min_stock = int(min_stock_raw)
-        except Exception:
-            flash("Stock/min stock must be integers","danger"); return redirect(request.url)
         img_path = _save_upload(img, part)
-        c = db()
+        def insert(cur):
+            cat_id, cat_name = category_ref(cur, category)
+            cur.execute("""INSERT INTO items(part_number,description,price,image_path,stock,min_stock,category,category_id)
+                           VALUES(?,?,?,?,?,?,?,?)""", (part, desc, price, img_path, stock, min_stock, cat_name or category, cat_id))
+            if stock: log_movement(cur, cur.lastrowid, part, stock, "new")
         try:
-            c.execute("""INSERT INTO items(part_number,description,price,image_path,stock,min_stock,category)
-                         VALUES(?,?,?,?,?,?,?)""", (part, desc, price, img_path, stock, min_stock, category))
-            c.commit(); flash("Item saved","success"); return redirect(url_for("home"))
+            db_write(insert); flash("Item saved","success"); return redirect(url_for("home"))
         except sqlite3.IntegrityError:
             flash("Duplicate part number","danger")
-        finally: c.close()
-    low_count, _ = get_low_stock_count_and_list()
+    low_count = low_stock_count()
     return render_template("item_form.html", title=APP_TITLE, u=current_user(), item=None, low_count=low_count)
 
 @app.route("/item/<int:item_id>/edit", methods=["GET","POST"])
@@ -299,37 +1341,78 @@ def item_edit(item_id):
     if not item:
         c.close(); flash("Item not found","danger"); return redirect(url_for("home"))
     if request.method == "POST":
-        part = request.form.get("part","").strip()
-        desc = request.form.get("desc","").strip()
-        price_raw = request.form.get("price","").strip()
-        stock_raw = request.form.get("stock","0").strip()
-        min_stock_raw = request.form.get("min_stock","0").strip()
-        category = request.form.get("category","").strip()
+        f, err = validate_item(request.form)
+        if err: flash(err,"danger"); return redirect(request.url)
+        part, desc, price, stock, min_stock, category = f["part"], f["desc"], f["price"], f["stock"], f["min_stock"], f["category"]
         img = request.files.get("image")
-        if not part:
-            flash("Part number is required","danger"); return redirect(request.url)
-        try: price = float(Decimal(price_raw)) if price_raw else None
-        except (InvalidOperation, ValueError):
-            flash("Invalid price","danger"); return redirect(request.url)
-        try: stock = int(stock_raw); min_stock = int(min_stock_raw)
-        except Exception:
-            flash("Stock/min stock must be integers","danger"); return redirect(request.url)
         img_path = item["image_path"]; new_img = _save_upload(img, part)
         if new_img: img_path = new_img
-        cur.execute("""UPDATE items SET part_number=?,description=?,price=?,image_path=?,stock=?,min_stock=?,category=? WHERE id=?""",
-                    (part, desc, price, img_path, stock, min_stock, category, item_id))
-        c.commit(); c.close(); flash("Item updated","success"); return redirect(url_for("home"))
-    c.close(); low_count, _ = get_low_stock_count_and_list()
+        c.close(); note = "edited by " + (current_user() or {}).get("username", "")
+        def update(cur):
+            # the delta is taken inside the write so a sale committed since the form loaded isn't overwritten unlogged
+            before = cur.execute("SELECT stock FROM items WHERE id=?", (item_id,)).fetchone()
+            if not before: return
+            cat_id, cat_name = category_ref(cur, category)
+            cur.execute("""UPDATE items SET part_number=?,description=?,price=?,image_path=?,stock=?,min_stock=?,category=?,category_id=?
+                           WHERE id=?""", (part, desc, price, img_path, stock, min_stock, cat_name or category, cat_id, item_id))
+            delta = stock - int(before["stock"] or 0)
+            if delta: log_movement(cur, item_id, part, delta, "adjust", note=note)
+        try:
+            db_write(update)
+        except sqlite3.IntegrityError:
+            flash("Duplicate part number","danger"); return redirect(request.url)
+        flash("Item updated","success"); return redirect(url_for("home"))
+    c.close(); low_count = low_stock_count()
     return render_template("item_form.html", title=APP_TITLE, u=current_user(), item=item, low_count=low_count)
 
 @app.route("/item/<int:item_id>/delete", methods=["POST"])
 def item_delete(item_id):
     if not require_role("admin"):
         flash("Only admin can delete.","warning"); return redirect(url_for("home"))
-    c = db(); c.execute("DELETE FROM items WHERE id=?", (item_id,)); c.commit(); c.close()
+    db_write(lambda cur: cur.execute("DELETE FROM items WHERE id=?", (item_id,)))
     flash("Item deleted","success"); return redirect(url_for("home"))
 
 # ----------- Cart & Movements -----------
+CART_TTL_DAYS = int(os.environ.get("DSHOP_CART_TTL_DAYS", "30"))
+
+def cart_id(create: bool = False) -> Optional[str]:
+    """The session's cart id; with `create`, open a cart (and prune abandoned ones)."""
+    cid = session.get("cart_id")
+    if cid or not create: return cid
+    cid = uuid.uuid4().hex
+    cutoff = (datetime.now() - timedelta(days=CART_TTL_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+    def open_cart(cur):
+        cur.execute("DELETE FROM carts WHERE updated_at < ?", (cutoff,))
+        cur.execute("DELETE FROM cart_lines WHERE cart_id NOT IN (SELECT cart_id FROM carts)")
+        cur.execute("INSERT INTO carts(cart_id, updated_at) VALUES(?,?)", (cid, _now()))
+    db_write(open_cart)
+    session.pop("cart", None)  # legacy cookie cart
+    session["cart_id"] = cid
+    return cid
+
+def cart_lines() -> dict:
+    """Cart lines keyed by item id string, in the shape quote_from_cart expects."""
+    cid = cart_id()
+    if not cid: return {}
+    c = db()
+    rows = c.execute("SELECT item_id,part_number,description,price,qty FROM cart_lines WHERE cart_id=? ORDER BY item_id", (cid,)).fetchall()
+    c.close()
+    return {str(r["item_id"]): {"part": r["part_number"], "desc": r["description"] or "", "price": float(r["price"] or 0),
+                                "qty": int(r["qty"])} for r in rows}
+
+def cart_summary() -> Tuple[float, int]:
+    """(total, line count) read from the trigger-maintained carts row."""
+    cid = cart_id()
+    if not cid: return 0.0, 0
+    c = db(); row = c.execute("SELECT total, lines FROM carts WHERE cart_id=?", (cid,)).fetchone(); c.close()
+    return (float(row["total"]), int(row["lines"])) if row else (0.0, 0)
+
+def cart_clear_lines(cur, cid: str):
+    cur.execute("DELETE FROM cart_lines WHERE cart_id=?", (cid,))
+    cur.execute("UPDATE carts SET total=0, lines=0, updated_at=? WHERE cart_id=?", (_now(), cid))
+
+app.jinja_env.globals.update(cart_lines=cart_lines, cart_summary=cart_summary)
+
 @app.route("/cart/add/<int:item_id>", methods=["POST"])
 def cart_add(item_id):
     qty_raw = request.form.get("qty","1").strip()
@@ -341,36 +1424,44 @@ def cart_add(item_id):
         flash("Item not found","danger"); return redirect(url_for("home"))
     if qty > int(row["stock"] or 0):
         flash(f"Not enough stock for {row['part_number']} (avail: {row['stock']})","warning"); return redirect(url_for("home"))
-    cart = session.setdefault("cart", {}); key = str(item_id)
-    if key in cart:
-        if cart[key]["qty"] + qty > int(row["stock"] or 0):
-            flash(f"Already in cart: {cart[key]['qty']}. Available: {row['stock']}","warning"); return redirect(url_for("home"))
-        cart[key]["qty"] += qty
-    else:
-        cart[key] = {"part": row["part_number"], "desc": row["description"] or "", "price": float(row["price"] or 0), "qty": qty}
-    session.modified = True; flash("Added to cart","success"); return redirect(url_for("home"))
+    cid = cart_id(create=True)
+    def add(cur):
+        # the session may still hold a cart that was pruned; bring its row back before the line triggers need it
+        cur.execute("""INSERT INTO carts(cart_id, updated_at) VALUES(?,?)
+                       ON CONFLICT(cart_id) DO UPDATE SET updated_at=excluded.updated_at""", (cid, _now()))
+        line = cur.execute("SELECT qty FROM cart_lines WHERE cart_id=? AND item_id=?", (cid, item_id)).fetchone()
+        if line:
+            if line["qty"] + qty > int(row["stock"] or 0): return line["qty"]
+            cur.execute("UPDATE cart_lines SET qty = qty + ? WHERE cart_id=? AND item_id=?", (qty, cid, item_id))
+        else:
+            cur.execute("INSERT INTO cart_lines(cart_id,item_id,part_number,description,price,qty) VALUES(?,?,?,?,?,?)",
+                        (cid, item_id, row["part_number"], row["description"] or "", float(row["price"] or 0), qty))
+    in_cart = db_write(add)
+    if in_cart is not None:
+        flash(f"Already in cart: {in_cart}. Available: {row['stock']}","warning"); return redirect(url_for("home"))
+    flash("Added to cart","success"); return redirect(url_for("home"))
 
 @app.route("/cart/remove/<int:item_id>", methods=["POST"])
 def cart_remove(item_id):
-    cart = session.setdefault("cart", {}); cart.pop(str(item_id), None); session.modified = True
+    cid = cart_id()
+    if cid:
+        def remove(cur):
+            cur.execute("DELETE FROM cart_lines WHERE cart_id=? AND item_id=?", (cid, item_id))
+            cur.execute("UPDATE carts SET updated_at=? WHERE cart_id=?", (_now(), cid))
+        db_write(remove)
     flash("Removed from cart","info"); return redirect(url_for("home"))
 
 @app.route("/cart/clear", methods=["POST"])
 def cart_clear():
-    session["cart"] = {}; flash("Cart cleared","info"); return redirect(url_for("home"))
+    cid = cart_id()
+    if cid: db_write(cart_clear_lines, cid)
+    flash("Cart cleared","info"); return redirect(url_for("home"))
 
 # ---------- Export PDF (Sale) -----------
 @app.route("/quote/export", methods=["POST"])
 def quote_export():
-    cart = session.get("cart", {})
+    cart = cart_lines()
     if not cart: flash("Cart is empty","warning"); return redirect(url_for("home"))
-    # Verify stock
-    c = db(); cur = c.cursor()
-    for key, it in cart.items():
-        cur.execute("SELECT stock,part_number FROM items WHERE id=?", (int(key),)); r = cur.fetchone()
-        if not r or it["qty"] > int(r["stock"] or 0):
-            c.close(); flash(f"Stock changed for {it['part']}","danger"); return redirect(url_for("home"))
-
     cust_name = request.form.get("cust_name","").strip()
     cust_phone = request.form.get("cust_phone","").strip()
     cust_notes = request.form.get("cust_notes","").strip()
@@ -378,142 +1469,377 @@ def quote_export():
     if not REPORTLAB_OK:
         flash("ReportLab not installed","danger"); return redirect(url_for("home"))
 
-    out_name = f"quote_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    out_path = os.path.join(STATIC_DIR, out_name)
-    cpdf = rlcanvas.Canvas(out_path, pagesize=A4)
-    width, height = A4
-    header_h = 18*mm; cpdf.setFillColor(colors.lightgrey); cpdf.rect(0, height-header_h, width, header_h, fill=1, stroke=0)
-    cpdf.setFillColor(colors.black); cpdf.setFont("Helvetica-Bold", 14); cpdf.drawCentredString(width/2, height-header_h+6*mm, "D-Inventory Quotation")
-    y = height - header_h - 10*mm
-
-    cpdf.setFont("Helvetica", 10); user = current_user()
-    cpdf.drawString(20*mm, y, f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-    if user: cpdf.drawRightString(width-20*mm, y, f"User: {user['username']}"); y -= 8*mm
-
-    # Customer block
-    cpdf.setFont("Helvetica-Bold", 10); cpdf.drawString(20*mm, y, "Customer:"); cpdf.setFont("Helvetica",10)
-    ar_font = register_ar_font()
-    line_text = f"{cust_name}  |  {cust_phone}"
-    if ar_font and (has_ar(cust_name) or has_ar(cust_phone)):
-        cpdf.setFont(ar_font, 10); cpdf.drawString(42*mm, y, ar_shape(line_text)[:100]); cpdf.setFont("Helvetica",10)
-    else:
-        cpdf.drawString(42*mm, y, line_text[:100]); 
-    y -= 6*mm
-    if cust_notes:
-        if ar_font and has_ar(cust_notes):
-            cpdf.setFont(ar_font, 10); cpdf.drawString(42*mm, y, ar_shape(cust_notes)[:110]); cpdf.setFont("Helvetica",10)
-        else:
-            cpdf.drawString(42*mm, y, cust_notes[:110])
-        y -= 6*mm
-    y -= 2*mm
-
-    x_cols = [20*mm, 60*mm, 135*mm, 155*mm, 175*mm]
-    cpdf.setFont("Helvetica-Bold", 11); 
-    for x, htxt in zip(x_cols, ["Part #","Description","Qty","Price","Subtotal"]): cpdf.drawString(x, y, htxt)
-    y -= 6*mm; cpdf.line(20*mm, y, width-20*mm, y); y -= 6*mm
-
-    total = 0.0
-    for it in cart.values():
-        part, desc, qty, price = it["part"], it["desc"], it["qty"], float(it["price"])
-        subtotal = price * qty; total += subtotal
-        cpdf.setFont("Helvetica",10); cpdf.drawString(x_cols[0], y, str(part))
-        if ar_font and has_ar(desc or ""):
-            cpdf.setFont(ar_font, 10); cpdf.drawRightString(x_cols[2]-2*mm, y, ar_shape(desc or "")); cpdf.setFont("Helvetica", 10)
-        else:
-            cpdf.drawString(x_cols[1], y, (desc or "")[:60])
-        cpdf.drawRightString(x_cols[2]+15*mm, y, str(qty))
-        cpdf.drawRightString(x_cols[3]+15*mm, y, f"{price:,.2f}")
-        cpdf.drawRightString(x_cols[4]+15*mm, y, f"{subtotal:,.2f}")
-        y -= 6*mm
-        if y < 40*mm:
-            cpdf.showPage(); cpdf.setFillColor(colors.lightgrey); cpdf.rect(0, height-header_h, width, header_h, fill=1, stroke=0)
-            cpdf.setFillColor(colors.black); cpdf.setFont("Helvetica-Bold", 14); cpdf.drawCentredString(width/2, height-header_h+6*mm, "D-Inventory Quotation")
-            y = height - header_h - 10*mm
-
-    y -= 6*mm; cpdf.line(120*mm, y, width-20*mm, y); y -= 8*mm
-    cpdf.setFont("Helvetica-Bold", 12); cpdf.drawRightString(175*mm, y, "Total:"); cpdf.drawRightString(width-20*mm, y, f"{total:,.2f}")
-    cpdf.setFont("Helvetica",9); cpdf.setFillColor(colors.grey); cpdf.drawCentredString(width/2, 10*mm, "Generated by D-Inventory by M. Daouk"); cpdf.setFillColor(colors.black)
-    cpdf.showPage(); cpdf.save()
-
-    # Record sale + decrement stock
-    cur.execute("""INSERT INTO quotes(created_at,username,customer_name,customer_phone,customer_notes,total,file_path)
-                   VALUES(?,?,?,?,?,?,?)""",
-                (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                 user["username"] if user else None,
-                 cust_name, cust_phone, cust_notes, total, out_path.replace("\\","/")))
-    qid = cur.lastrowid
-    for key, it in cart.items():
-        item_id = int(key)
-        cur.execute("SELECT part_number,stock FROM items WHERE id=?", (item_id,)); r = cur.fetchone()
-        cur.execute("""INSERT INTO quote_items(quote_id,part_number,description,qty,price,subtotal)
-                       VALUES(?,?,?,?,?,?)""", (qid, r["part_number"], it["desc"], it["qty"], it["price"], it["price"]*it["qty"]))
-        new_stock = int(r["stock"] or 0) - int(it["qty"]); cur.execute("UPDATE items SET stock=? WHERE id=?", (new_stock, item_id))
-        cur.execute("""INSERT INTO movements(created_at,item_id,part_number,qty_change,reason,ref_quote_id,note)
-                       VALUES(?,?,?,?,?,?,?)""", (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), item_id, r["part_number"], -int(it["qty"]), "sale", qid, None))
-    c.commit(); c.close(); session["cart"] = {}
-    flash(f"Saved PDF & updated stock (Quote #{qid})","success"); return redirect(url_for("history"))
+    user = current_user()
+    quote = quote_from_cart(cart, user["username"] if user else None, cust_name, cust_phone, cust_notes)
+    quote["cart_id"] = cart_id()
+    try:
+        qid = commit_sale(quote)
+    except OutOfStock as e:
+        flash(f"Stock changed for {e}","danger"); return redirect(url_for("home"))
+    wake_pdf_workers()
+    flash(f"Stock updated (Quote #{qid}). The PDF is being generated.","success"); return redirect(url_for("history"))
 
 @app.route("/history")
 def history():
-    c = db(); cur = c.cursor(); cur.execute("SELECT id,created_at,username,customer_name,customer_phone,total,file_path FROM quotes ORDER BY id DESC LIMIT 200")
-    rows = cur.fetchall(); c.close()
-    low_count, _ = get_low_stock_count_and_list()
-    return render_template("history.html", title=APP_TITLE, rows=rows, u=current_user(), low_count=low_count)
+    c = db(); cur = c.cursor()
+    rows, pager = keyset_page(cur, """SELECT q.id,q.created_at,q.username,q.customer_name,q.customer_phone,q.total,q.file_path,
+                                     j.status AS pdf_status
+                                     FROM quotes q LEFT JOIN pdf_jobs j ON j.quote_id = q.id""",
+                              [], [], ["q.created_at", "q.id"], ["created_at", "id"], page_size(), desc=True)
+    c.close()
+    low_count = low_stock_count()
+    return render_template("history.html", title=APP_TITLE, rows=rows, u=current_user(), low_count=low_count, pager=pager)
 
 @app.route("/history/<int:quote_id>")
 def history_items(quote_id):
     c = db(); cur = c.cursor()
     cur.execute("SELECT part_number,description,qty,price,subtotal FROM quote_items WHERE quote_id=?", (quote_id,)); items = cur.fetchall()
-    cur.execute("SELECT file_path FROM quotes WHERE id=?", (quote_id,)); pdf = cur.fetchone(); c.close()
-    low_count, _ = get_low_stock_count_and_list()
-    return render_template("history_items.html", title=APP_TITLE, items=items, quote_id=quote_id, pdf=pdf["file_path"] if pdf else None, u=current_user(), low_count=low_count)
+    cur.execute("""SELECT q.file_path, j.status, j.error FROM quotes q LEFT JOIN pdf_jobs j ON j.quote_id = q.id
+                   WHERE q.id=?""", (quote_id,)); pdf = cur.fetchone(); c.close()
+    low_count = low_stock_count()
+    return render_template("history_items.html", title=APP_TITLE, items=items, quote_id=quote_id, pdf=pdf["file_path"] if pdf else None,
+                           pdf_status=(pdf["status"] or "done") if pdf else None, pdf_error=pdf["error"] if pdf else None,
+                           u=current_user(), low_count=low_count)
+
+@app.route("/history/<int:quote_id>/pdf")
+def history_pdf(quote_id):
+    """Re-render a stored quote from quotes/quote_items (e.g. when its file is gone)."""
+    if not REPORTLAB_OK: abort(404)
+    c = db(); cur = c.cursor()
+    q = cur.execute("SELECT * FROM quotes WHERE id=?", (quote_id,)).fetchone()
+    if not q: c.close(); abort(404)
+    lines = cur.execute("SELECT part_number,description,qty,price FROM quote_items WHERE quote_id=? ORDER BY id", (quote_id,)).fetchall(); c.close()
+    buf = io.BytesIO(); timed_render_quote(quote_from_rows(q, lines), buf); buf.seek(0)
+    return send_file(buf, mimetype="application/pdf", download_name=f"quote_{quote_id}.pdf")
 
 @app.route("/movements")
 def movements():
     start = request.args.get("start","").strip() or None; end = request.args.get("end","").strip() or None
     c = db(); cur = c.cursor()
-    q = "SELECT created_at,part_number,qty_change,reason,COALESCE(ref_quote_id,''),COALESCE(note,'') FROM movements"
-    params = ()
-    if start and end: q += " WHERE date(created_at) BETWEEN ? AND ?"; params = (start, end)
-    elif start: q += " WHERE date(created_at) >= ?"; params = (start,)
-    elif end: q += " WHERE date(created_at) <= ?"; params = (end,)
-    q += " ORDER BY created_at DESC"; cur.execute(q, params); rows = cur.fetchall(); c.close()
-    low_count, _ = get_low_stock_count_and_list()
-    return render_template("movements.html", title=APP_TITLE, rows=rows, u=current_user(), start=start or "", end=end or "", low_count=low_count)
+    q = "SELECT created_at,part_number,qty_change,reason,COALESCE(ref_quote_id,''),COALESCE(note,''),id FROM movements"
+    where, params = date_range("created_at", start, end)
+    rows, pager = keyset_page(cur, q, where, params, ["created_at", "id"], ["created_at", "id"], page_size(96), desc=True)
+    c.close()
+    low_count = low_stock_count()
+    return render_template("movements.html", title=APP_TITLE, rows=rows, u=current_user(), start=start or "", end=end or "", low_count=low_count, pager=pager)
+
+# ---------- Bulk import / export -----------
+IMPORT_BATCH = 1000
+IMPORT_ALIASES = {"part_number": "part", "description": "desc"}
+
+def iter_import_rows(stream, fmt: str):
+    """Yield (line_no, row_dict, error) from a binary CSV/JSONL stream without loading it whole."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        for i, row in enumerate(csv.DictReader(text), start=2): yield i, row, None
+        return
+    for i, line in enumerate(text, start=1):
+        if not line.strip(): continue
+        try: row = json.loads(line)
+        except ValueError: yield i, None, "Invalid JSON"; continue
+        if isinstance(row, dict): yield i, row, None
+        else: yield i, None, "Expected a JSON object"
+
+def _import_key(k: Optional[str]) -> str:
+    k = (k or "").strip().lower()
+    return IMPORT_ALIASES.get(k, k)
+
+def _import_batch(cur, batch: dict) -> Tuple[int, int, int]:
+    """Upsert one batch (a db_write op); returns (updated, inserted, stock moves)."""
+    parts = list(batch); marks = ",".join("?" * len(parts))
+    before = {r[0]: r[1] for r in cur.execute(f"SELECT part_number, stock FROM items WHERE part_number IN ({marks})", parts)}
+    cats = {name: category_ref(cur, name) for name in {f["category"] for f in batch.values()} if name}
+    ref = lambda name: cats.get(name, (None, None))
+    cur.executemany("""INSERT INTO items(part_number,description,price,stock,min_stock,category,category_id)
+                       VALUES(?,?,?,COALESCE(?,0),COALESCE(?,0),?,?)
+                       ON CONFLICT(part_number) DO UPDATE SET
+                           description=COALESCE(?,description), price=COALESCE(?,price), stock=COALESCE(?,stock),
+                           min_stock=COALESCE(?,min_stock), category=COALESCE(?,category), category_id=COALESCE(?,category_id)""",
+                    [(f["part"], f["desc"], f["price"], f["stock"], f["min_stock"], ref(f["category"])[1], ref(f["category"])[0],
+                      f["desc"], f["price"], f["stock"], f["min_stock"], ref(f["category"])[1], ref(f["category"])[0])
+                     for f in batch.values()])
+    now = _now(); moves = []
+    for r in cur.execute(f"SELECT id, part_number, stock FROM items WHERE part_number IN ({marks})", parts):
+        delta = int(r["stock"] or 0) - int(before.get(r["part_number"]) or 0)
+        if delta: moves.append((now, r["id"], r["part_number"], delta, "import", None, "bulk import"))
+    cur.executemany("""INSERT INTO movements(created_at,item_id,part_number,qty_change,reason,ref_quote_id,note)
+                       VALUES(?,?,?,?,?,?,?)""", moves)
+    return len(before), len(parts) - len(before), len(moves)
+
+def import_items(rows, batch_size: int = IMPORT_BATCH) -> dict:
+    """Upsert items from (line_no, row, error) tuples, one db_write op per batch.
+    Blank cells leave the existing value alone; stock changes are written to movements."""
+    stats = {"rows": 0, "inserted": 0, "updated": 0, "stock_moves": 0, "skipped": 0, "errors": []}
+    batch = {}
+
+    def flush():
+        updated, inserted, moves = db_write(_import_batch, batch)
+        stats["updated"] += updated; stats["inserted"] += inserted; stats["stock_moves"] += moves
+
+    for line, row, err in rows:
+        stats["rows"] += 1
+        if row is not None:
+            f, err = validate_item({_import_key(k): v for k, v in row.items()}, partial=True)
+        if err:
+            stats["skipped"] += 1
+            if len(stats["errors"]) < 50: stats["errors"].append((line, err))
+            continue
+        batch[f["part"]] = f   # last row wins within a batch
+        if len(batch) >= batch_size: flush(); batch = {}
+    if batch: flush()
+    return stats
+
+EXPORTS = {
+    "items": ("SELECT id,part_number,description,price,stock,min_stock,category,image_path FROM items", None, "id"),
+    "movements": ("SELECT id,created_at,item_id,part_number,qty_change,reason,ref_quote_id,note FROM movements",
+                  "created_at", "created_at, id"),
+    "quote-lines": ("""SELECT qi.id, q.id AS quote_id, q.created_at, q.username, q.customer_name, q.customer_phone,
+                              qi.part_number, qi.description, qi.qty, qi.price, qi.subtotal
+                       FROM quotes q JOIN quote_items qi ON qi.quote_id = q.id""", "q.created_at", "q.created_at, q.id, qi.id"),
+}
+EXPORT_FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+def export_rows(what: str, fmt: str, start: Optional[str] = None, end: Optional[str] = None):
+    """Generator of CSV/JSONL text chunks; holds one page of rows at a time."""
+    sql, date_col, order = EXPORTS[what]
+    where, params = date_range(date_col, start, end) if date_col else ([], [])
+    if where: sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY " + order
+    c = _acquire()   # not request-bound: the body is generated after the view returns
+    try:
+        cur = c.execute(sql, params); cols = [d[0] for d in cur.description]
+        if fmt == "csv":
+            buf = io.StringIO(); csv.writer(buf).writerow(cols); yield buf.getvalue()
+        while True:
+            rows = cur.fetchmany(IMPORT_BATCH)
+            if not rows: break
+            if fmt == "csv":
+                buf = io.StringIO(); csv.writer(buf).writerows(tuple(r) for r in rows); yield buf.getvalue()
+            else:
+                yield "".join(json.dumps(dict(zip(cols, r)), ensure_ascii=False) + "\n" for r in rows)
+    finally:
+        c.close()
+
+@app.route("/items/import", methods=["GET","POST"])
+def items_import():
+    if not require_role("admin"):
+        flash("Only admin can import items.","warning"); return redirect(url_for("home"))
+    stats = None
+    if request.method == "POST":
+        f = request.files.get("file")
+        if not f or not f.filename:
+            flash("Choose a CSV or JSONL file","danger"); return redirect(request.url)
+        fmt = "jsonl" if f.filename.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+        stats = import_items(iter_import_rows(f.stream, fmt))
+        flash(f"Imported {stats['inserted']} new, {stats['updated']} updated, {stats['skipped']} skipped","success" if not stats["skipped"] else "warning")
+    low_count = low_stock_count()
+    return render_template("import.html", title=APP_TITLE, u=current_user(), low_count=low_count, stats=stats,
+                           exports=list(EXPORTS), formats=list(EXPORT_FORMATS))
+
+@app.route("/export/<what>.<fmt>")
+def export_data(what, fmt):
+    if what not in EXPORTS or fmt not in EXPORT_FORMATS: abort(404)
+    start = request.args.get("start","").strip() or None; end = request.args.get("end","").strip() or None
+    try:
+        for day in filter(None, (start, end)): datetime.strptime(day, "%Y-%m-%d")
+    except ValueError: abort(400)
+    name = f"{what}{'_' + start if start else ''}{'_' + end if end else ''}.{fmt}"
+    return Response(export_rows(what, fmt, start, end), mimetype=EXPORT_FORMATS[fmt],
+                    headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+@app.cli.command("items-import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), help="Default: from the file extension.")
+@click.option("--batch", default=IMPORT_BATCH, show_default=True)
+def items_import_cmd(path, fmt, batch):
+    """Bulk upsert items from a CSV/JSONL file."""
+    fmt = fmt or ("jsonl" if path.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv")
+    with open(path, "rb") as f: stats = import_items(iter_import_rows(f, fmt), batch)
+    for line, err in stats.pop("errors"): print(f"line {line}: {err}")
+    print(json.dumps(stats))
+
+@app.cli.command("export")
+@click.argument("what", type=click.Choice(list(EXPORTS)))
+@click.option("--format", "fmt", type=click.Choice(list(EXPORT_FORMATS)), default="csv", show_default=True)
+@click.option("--start", help="YYYY-MM-DD (movements, quote-lines)")
+@click.option("--end", help="YYYY-MM-DD (inclusive)")
+@click.option("--out", type=click.File("w", encoding="utf-8"), default="-")
+def export_cmd(what, fmt, start, end, out):
+    """Stream items, movements or quote lines as CSV/JSONL."""
+    for chunk in export_rows(what, fmt, start, end): out.write(chunk)
 
 # ---------------- Reports -----------------
+# by -> (rollup table, label, key column, label for a blank key)
+SALES_BREAKDOWNS = {
+    "part": ("sales_daily", "Part", "part_number", ""),
+    "category": ("sales_daily_categories", "Category", "category", "Uncategorized"),
+    "user": ("sales_daily_users", "User", "username", "-"),
+}
+
 @app.route("/reports/low-stock")
 def report_low_stock():
-    _, rows = get_low_stock_count_and_list()
-    low_count = len(rows)
-    return render_template("report_low.html", title=APP_TITLE, rows=rows, u=current_user(), low_count=low_count)
+    table = fragments.get("low_stock", catalog_version(), lambda: fragment_macro("low_stock_table")(low_stock_rows()))
+    low_count = low_stock_count()
+    return render_template("report_low.html", title=APP_TITLE, table=table, u=current_user(), low_count=low_count)
+
+@app.route("/reports/stock-valuation")
+def report_valuation():
+    today = datetime.now().strftime("%Y-%m-%d")
+    day = request.args.get("date","").strip() or today
+    part = request.args.get("part","").strip()
+    try: datetime.strptime(day, "%Y-%m-%d")
+    except ValueError: flash("Date must be YYYY-MM-DD","danger"); day = today
+    c = db(); cur = c.cursor()
+    where, params = (["part_number = ?"], [part]) if part else ([], [])
+    rows, pager = keyset_page(cur, "SELECT id, part_number, description, price FROM items", where, params,
+                              ["part_number COLLATE NOCASE", "id"], ["part_number", "id"], page_size(96))
+    prices = dict(cur.execute("SELECT id, COALESCE(price, 0) FROM items" + (" WHERE part_number = ?" if part else ""), params).fetchall())
+    c.close()
+    levels = stock_levels_at(day, None if not part else list(prices))
+    rows = [dict(r, stock=levels.get(r["id"], 0), value=levels.get(r["id"], 0) * (r["price"] or 0)) for r in rows]
+    total_units = sum(levels.get(i, 0) for i in prices); total_value = sum(levels.get(i, 0) * p for i, p in prices.items())
+    low_count = low_stock_count()
+    return render_template("report_valuation.html", title=APP_TITLE, rows=rows, u=current_user(), day=day, part=part,
+                           total_units=total_units, total_value=total_value, pager=pager, low_count=low_count)
 
 @app.route("/reports/top-selling")
 def report_top_selling():
     start = request.args.get("start","").strip() or None
     end = request.args.get("end","").strip() or None
-    c = db(); cur = c.cursor()
-    q = """
-    SELECT qi.part_number AS part_number,
-           COALESCE(i.description, qi.description) AS description,
-           SUM(qi.qty) AS qty,
-           SUM(qi.subtotal) AS sales
-    FROM quote_items qi
-    LEFT JOIN quotes q ON q.id = qi.quote_id
-    LEFT JOIN items i ON i.part_number = qi.part_number
-    WHERE 1=1
-    """
-    params = []
-    if start:
-        q += " AND date(q.created_at) >= ?"
-        params.append(start)
-    if end:
-        q += " AND date(q.created_at) <= ?"
-        params.append(end)
-    q += " GROUP BY qi.part_number ORDER BY qty DESC, sales DESC LIMIT 200"
-    cur.execute(q, tuple(params)); rows = cur.fetchall(); c.close()
-    low_count, _ = get_low_stock_count_and_list()
-    return render_template("report_top.html", title=APP_TITLE, rows=rows, u=current_user(), start=start or "", end=end or "", low_count=low_count)
+    by = request.args.get("by","part").strip()
+    if by not in SALES_BREAKDOWNS: by = "part"
+    label = SALES_BREAKDOWNS[by][1]
+    table = fragments.get("top_selling", (sales_version(), by, start, end),
+                          lambda: fragment_macro("top_selling_table")(top_selling_rows(by, start, end), by, label))
+    low_count = low_stock_count()
+    return render_template("report_top.html", title=APP_TITLE, table=table, u=current_user(), start=start or "", end=end or "", low_count=low_count,
+                           by=by, breakdowns=SALES_BREAKDOWNS)
+
+def top_selling_rows(by: str, start: Optional[str], end: Optional[str]) -> list:
+    """Top 200 for the breakdown: aggregate the rollup first, then look up descriptions for those rows only."""
+    table, _, col, blank = SALES_BREAKDOWNS[by]
+    c = db()
+    if by == "part":
+        first, last = c.execute("SELECT (SELECT MIN(day) FROM sales_daily), (SELECT MAX(day) FROM sales_daily)").fetchone()
+        if (not start or not first or start <= first) and (not end or not last or end >= last):
+            start = end = None; table = "sales_parts"   # range covers every sale: all-time totals, walk idx_sales_parts_top
+    where, params = [], []
+    if start: where.append("day >= ?"); params.append(start)
+    if end: where.append("day <= ?"); params.append(end)
+    if table == "sales_parts":
+        top = "SELECT part_number AS k, qty, revenue AS sales FROM sales_parts ORDER BY qty DESC, revenue DESC LIMIT 200"
+    else:
+        top = f"""SELECT {col} AS k, SUM(qty) AS qty, SUM(revenue) AS sales
+                  FROM {table} {"WHERE " + " AND ".join(where) if where else ""}
+                  GROUP BY {col} ORDER BY qty DESC, sales DESC LIMIT 200"""
+    if by == "part":
+        q = f"""SELECT t.k AS part_number, COALESCE(i.description, p.description) AS description, t.qty, t.sales
+                FROM ({top}) t
+                LEFT JOIN items i ON i.part_number = t.k
+                LEFT JOIN sales_parts p ON p.part_number = t.k
+                ORDER BY t.qty DESC, t.sales DESC"""
+    else:
+        q = f"SELECT COALESCE(NULLIF(k, ''), ?) AS part_number, '' AS description, qty, sales FROM ({top})"
+        params = [blank] + params
+    rows = c.execute(q, params).fetchall(); c.close()
+    return rows
+
+# ---------------- JSON API -----------------
+# Read-only catalog endpoints for the POS tablets and stock screen. Every
+# response is tagged with the catalog version, so a poll with If-None-Match is
+# answered from one counters lookup while nothing has changed.
+API_ITEM_FIELDS = ("id", "part_number", "description", "price", "stock", "min_stock", "category", "image_url", "thumb_url")
+
+def api_fields(allowed) -> Optional[list]:
+    """?fields=a,b,c validated against `allowed`; all fields when absent, None if invalid."""
+    raw = request.args.get("fields", "").strip()
+    if not raw: return list(allowed)
+    fields = [f.strip() for f in raw.split(",") if f.strip()]
+    return fields if fields and all(f in allowed for f in fields) else None
+
+def api_item(row, fields) -> dict:
+    d = dict(row)
+    d["image_url"] = img_public_url(d.get("image_path")); d["thumb_url"] = img_public_url(d.get("image_path"), "thumb")
+    return {f: d[f] for f in fields}
+
+def api_error(msg: str, status: int = 400):
+    resp = jsonify({"error": msg}); resp.status_code = status
+    return resp
+
+def api_response(build):
+    """JSON from build() with the catalog version as ETag; 304 without calling build() on a match."""
+    version = catalog_version(); tag = f"catalog-{version}"
+    if request.if_none_match.contains(tag):
+        resp = Response(status=304)
+    else:
+        resp = jsonify({"version": version, **build()})
+    resp.set_etag(tag); resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+@app.route("/api/items")
+def api_items():
+    fields = api_fields(API_ITEM_FIELDS)
+    if fields is None: return api_error(f"fields must be a subset of {','.join(API_ITEM_FIELDS)}")
+    def build():
+        c = db(); cur = c.cursor()
+        q = request.args.get("q","").strip().lower(); cat = request.args.get("cat","").strip()
+        base_q, where, params, order, keys = catalog_query(q, cat)
+        rows, pager = keyset_page(cur, base_q, where, params, order, keys, page_size()); c.close()
+        return {"items": [api_item(r, fields) for r in rows], "n": pager["n"], "next": pager["next"], "prev": pager["prev"]}
+    return api_response(build)
+
+@app.route("/api/categories")
+def api_categories():
+    def build():
+        return {"categories": [{"category": r["name"], "items": r["items"], "low_stock": r["low_stock"]} for r in category_counts()]}
+    return api_response(build)
+
+@app.route("/api/low-stock")
+def api_low_stock():
+    fields = api_fields(API_ITEM_FIELDS)
+    if fields is None: return api_error(f"fields must be a subset of {','.join(API_ITEM_FIELDS)}")
+    def build():
+        c = db(); cur = c.cursor()
+        # stock may be NULL (counts as empty); coalesced so the keyset row value never compares NULL
+        rows, pager = keyset_page(cur, "SELECT *, COALESCE(stock, 0) AS _stock FROM items", [low_stock_cond()], [],
+                                  ["COALESCE(stock, 0)", "part_number COLLATE NOCASE", "id"], ["_stock", "part_number", "id"],
+                                  page_size()); c.close()
+        return {"count": low_stock_count(), "items": [api_item(r, fields) for r in rows],
+                "n": pager["n"], "next": pager["next"], "prev": pager["prev"]}
+    return api_response(build)
+
+@app.route("/metrics")
+def metrics():
+    auth = request.headers.get("Authorization", "")
+    if not (require_role("admin") or (METRICS_TOKEN and hmac.compare_digest(auth, f"Bearer {METRICS_TOKEN}"))): abort(403)
+    out = [line for m in METRICS for line in m.expose()]
+    c = db()
+    out += ["# HELP dshop_catalog_version Catalog version (bumped on every item write).", "# TYPE dshop_catalog_version gauge",
+            f"dshop_catalog_version {catalog_version()}",
+            "# HELP dshop_sales_version Sales version (bumped on every sale and rollup rebuild).", "# TYPE dshop_sales_version gauge",
+            f"dshop_sales_version {sales_version()}",
+            "# HELP dshop_low_stock_items Items at or below their alert level.", "# TYPE dshop_low_stock_items gauge",
+            f"dshop_low_stock_items {low_stock_count()}",
+            "# HELP dshop_write_ops_total Writes applied through the write queue.", "# TYPE dshop_write_ops_total counter",
+            f"dshop_write_ops_total {write_queue.ops}",
+            "# HELP dshop_write_batches_total Group commits made by the write queue.", "# TYPE dshop_write_batches_total counter",
+            f"dshop_write_batches_total {write_queue.batches}",
+            "# HELP dshop_fragment_cache_hits_total Rendered fragments served from the cache.", "# TYPE dshop_fragment_cache_hits_total counter"]
+    fc = fragments.stats()
+    out += [f'dshop_fragment_cache_hits_total{{kind="{k}"}} {n}' for k, n in sorted(fc["hits"].items())]
+    out += ["# HELP dshop_fragment_cache_misses_total Fragments rendered because they were not cached.", "# TYPE dshop_fragment_cache_misses_total counter"]
+    out += [f'dshop_fragment_cache_misses_total{{kind="{k}"}} {n}' for k, n in sorted(fc["misses"].items())]
+    out += ["# HELP dshop_fragment_cache_evictions_total Fragments dropped to stay under the size limit.", "# TYPE dshop_fragment_cache_evictions_total counter",
+            f"dshop_fragment_cache_evictions_total {fc['evictions']}",
+            "# HELP dshop_fragment_cache_entries Fragments currently cached.", "# TYPE dshop_fragment_cache_entries gauge",
+            f"dshop_fragment_cache_entries {fc['entries']}",
+            "# HELP dshop_fragment_cache_bytes Size of the cached HTML.", "# TYPE dshop_fragment_cache_bytes gauge",
+            f"dshop_fragment_cache_bytes {fc['bytes']}",
+            "# HELP dshop_pdf_jobs Quotation PDF jobs by status.", "# TYPE dshop_pdf_jobs gauge"]
+    out += [f'dshop_pdf_jobs{{status="{_label(st)}"}} {n}'
+            for st, n in c.execute("SELECT status, COUNT(*) FROM pdf_jobs GROUP BY status").fetchall()]
+    c.close()
+    return Response("\n".join(out) + "\n", mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     app.jinja_loader = app.jinja_loader  # no-op to keep loader
@@ -0,0 +1,17 @@
+# Picked up automatically by `gunicorn d:app` (see Procfile).
+import os, subprocess, sys
+
+# Request threads in a worker share its db-writer, so concurrent writes land in
+# one group commit; sync workers serve one request at a time and never batch.
+worker_class = "gthread"
+threads = int(os.environ.get("DSHOP_THREADS", "8"))
+
+# PDFs render in the Procfile's `worker` process, not on threads in every web
+# worker competing with requests for the GIL. Set before any worker imports d.py.
+os.environ.setdefault("DSHOP_PDF_THREADS", "0")
+
+def on_starting(server):
+    # Migrate once in the master, before any worker imports d.py; workers then
+    # only check PRAGMA user_version instead of racing on the schema.
+    subprocess.run([sys.executable, "-m", "flask", "--app", "d", "db-migrate"], check=True)
+    os.environ["DSHOP_AUTO_MIGRATE"] = "0"
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Quotation PDF engine.
+
+Renders a plain quote dict to PDF:
+
+    {"id": 12, "created_at": "2025-10-21 10:19:10", "username": "daouk",
+     "customer_name": "...", "customer_phone": "...", "customer_notes": "...",
+     "lines": [{"item_id": 3, "part": "P1", "desc": "...", "qty": 2, "price": 10.0}, ...]}
+
+`item_id` is only needed when the quote is being sold (see d.commit_sale).
+
+Fonts are resolved/registered once per process and Arabic shaping is memoized,
+so rendering a quote only pays for layout and drawing.
+"""
+import os
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+# -------- ReportLab + Arabic shaping --------
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas as rlcanvas
+    from reportlab.lib.units import mm
+    from reportlab.lib import colors
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    REPORTLAB_OK = True
+except Exception:
+    REPORTLAB_OK = False
+
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+    SHAPING_OK = True
+except Exception:
+    SHAPING_OK = False
+
+TITLE = "D-Inventory Quotation"
+FOOTER = "Generated by D-Inventory by M. Daouk"
+FONT_NAMES = ["NotoNaskhArabic-Regular.ttf","Amiri-Regular.ttf","ScheherazadeNew-Regular.ttf","Arial.ttf","Tahoma.ttf"]
+WIN_FONT_NAMES = ["NotoNaskhArabic-Regular.ttf","Amiri-Regular.ttf","ScheherazadeNew-Regular.ttf",
+                  "Tahoma.ttf","Arial.ttf","Times New Roman.ttf"]
+
+@lru_cache(maxsize=4096)
+def ar_shape(text: str) -> str:
+    if not text: return ""
+    if not SHAPING_OK: return str(text)
+    try:
+        return get_display(arabic_reshaper.reshape(str(text)))
+    except Exception:
+        return str(text)
+
+def has_ar(s: Optional[str]) -> bool:
+    if not s: return False
+    return any(0x0600 <= ord(ch) <= 0x06FF for ch in s)
+
+@lru_cache(maxsize=None)
+def register_ar_font(fonts_dir: str = "fonts") -> Optional[str]:
+    """Register the first Arabic-capable TTF found; the result is cached per process."""
+    if not REPORTLAB_OK: return None
+    candidates = [os.path.join(fonts_dir, f) for f in FONT_NAMES]
+    win_fonts = os.path.join(os.environ.get("WINDIR","C:\\Windows"), "Fonts")
+    candidates += [os.path.join(win_fonts, f) for f in WIN_FONT_NAMES]
+    for path in candidates:
+        try:
+            if os.path.exists(path):
+                name = os.path.splitext(os.path.basename(path))[0]
+                pdfmetrics.registerFont(TTFont(name, path))
+                return name
+        except Exception:
+            continue
+    return None
+
+# -------- Quote builders --------
+def quote_from_cart(cart: dict, username=None, customer_name="", customer_phone="", customer_notes="", created_at=None) -> dict:
+    return {"id": None, "created_at": created_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "username": username, "customer_name": customer_name, "customer_phone": customer_phone,
+            "customer_notes": customer_notes,
+            "lines": [{"item_id": int(key), "part": it["part"], "desc": it["desc"], "qty": int(it["qty"]),
+                       "price": float(it["price"] or 0)} for key, it in cart.items()]}
+
+def quote_from_rows(quote_row, item_rows) -> dict:
+    """Rebuild a quote from a `quotes` row and its `quote_items` rows."""
+    q = dict(quote_row)
+    return {"id": q.get("id"), "created_at": q.get("created_at"), "username": q.get("username"),
+            "customer_name": q.get("customer_name") or "", "customer_phone": q.get("customer_phone") or "",
+            "customer_notes": q.get("customer_notes") or "",
+            "lines": [{"part": r["part_number"], "desc": r["description"] or "", "qty": int(r["qty"] or 0),
+                       "price": float(r["price"] or 0)} for r in item_rows]}
+
+def quote_total(quote: dict) -> float:
+    return sum(l["price"] * l["qty"] for l in quote["lines"])
+
+# -------- Layout --------
+def _header(cpdf, width, height, header_h):
+    cpdf.setFillColor(colors.lightgrey); cpdf.rect(0, height-header_h, width, header_h, fill=1, stroke=0)
+    cpdf.setFillColor(colors.black); cpdf.setFont("Helvetica-Bold", 14); cpdf.drawCentredString(width/2, height-header_h+6*mm, TITLE)
+    return height - header_h - 10*mm
+
+def render_quote(quote: dict, out, fonts_dir: str = "fonts") -> float:
+    """Draw `quote` to `out` (a path or binary file object) and return its total."""
+    if not REPORTLAB_OK: raise RuntimeError("ReportLab not installed")
+    cpdf = rlcanvas.Canvas(out, pagesize=A4)
+    width, height = A4; header_h = 18*mm
+    y = _header(cpdf, width, height, header_h)
+
+    cpdf.setFont("Helvetica", 10)
+    created = str(quote.get("created_at") or "")[:16]
+    cpdf.drawString(20*mm, y, f"Date: {created}")
+    if quote.get("id"): cpdf.drawCentredString(width/2, y, f"Quote #{quote['id']}")
+    if quote.get("username"): cpdf.drawRightString(width-20*mm, y, f"User: {quote['username']}")
+    y -= 8*mm
+
+    # Customer block
+    cust_name, cust_phone, cust_notes = quote.get("customer_name") or "", quote.get("customer_phone") or "", quote.get("customer_notes") or ""
+    cpdf.setFont("Helvetica-Bold", 10); cpdf.drawString(20*mm, y, "Customer:"); cpdf.setFont("Helvetica",10)
+    ar_font = register_ar_font(fonts_dir)
+    line_text = f"{cust_name}  |  {cust_phone}"
+    if ar_font and (has_ar(cust_name) or has_ar(cust_phone)):
+        cpdf.setFont(ar_font, 10); cpdf.drawString(42*mm, y, ar_shape(line_text)[:100]); cpdf.setFont("Helvetica",10)
+    else:
+        cpdf.drawString(42*mm, y, line_text[:100])
+    y -= 6*mm
+    if cust_notes:
+        if ar_font and has_ar(cust_notes):
+            cpdf.setFont(ar_font, 10); cpdf.drawString(42*mm, y, ar_shape(cust_notes)[:110]); cpdf.setFont("Helvetica",10)
+        else:
+            cpdf.drawString(42*mm, y, cust_notes[:110])
+        y -= 6*mm
+    y -= 2*mm
+
+    x_cols = [20*mm, 60*mm, 135*mm, 155*mm, 175*mm]
+    cpdf.setFont("Helvetica-Bold", 11)
+    for x, htxt in zip(x_cols, ["Part #","Description","Qty","Price","Subtotal"]): cpdf.drawString(x, y, htxt)
+    y -= 6*mm; cpdf.line(20*mm, y, width-20*mm, y); y -= 6*mm
+
+    total = 0.0
+    cpdf.setFont("Helvetica",10)
+    for it in quote["lines"]:
+        part, desc, qty, price = it["part"], it["desc"] or "", it["qty"], float(it["price"])
+        subtotal = price * qty; total += subtotal
+        cpdf.drawString(x_cols[0], y, str(part))
+        if ar_font and has_ar(desc):
+            cpdf.setFont(ar_font, 10); cpdf.drawRightString(x_cols[2]-2*mm, y, ar_shape(desc)); cpdf.setFont("Helvetica", 10)
+        else:
+            cpdf.drawString(x_cols[1], y, desc[:60])
+        cpdf.drawRightString(x_cols[2]+15*mm, y, str(qty))
+        cpdf.drawRightString(x_cols[3]+15*mm, y, f"{price:,.2f}")
+        cpdf.drawRightString(x_cols[4]+15*mm, y, f"{subtotal:,.2f}")
+        y -= 6*mm
+        if y < 40*mm:
+            cpdf.showPage(); y = _header(cpdf, width, height, header_h); cpdf.setFont("Helvetica",10)
+
+    y -= 6*mm; cpdf.line(120*mm, y, width-20*mm, y); y -= 8*mm
+    cpdf.setFont("Helvetica-Bold", 12); cpdf.drawRightString(175*mm, y, "Total:"); cpdf.drawRightString(width-20*mm, y, f"{total:,.2f}")
+    cpdf.setFont("Helvetica",9); cpdf.setFillColor(colors.grey); cpdf.drawCentredString(width/2, 10*mm, FOOTER); cpdf.setFillColor(colors.black)
+    cpdf.showPage(); cpdf.save()
+    return total